@@ -0,0 +1,87 @@
+import argparse
+import os
+import time
+import numpy as np
+import torch
+from dataset import MyDataset
+from export import load_model, check_weights, load_torchscript, example_input
+
+# Latency and accuracy of the eager model against the graphs written by export.py,
+# on CPU, over validation clips (or random input with --random).
+
+
+def load_variants(args):
+    variants = [('eager_fp32', load_model(args.weights))]
+    for name in ('lipnet_fp32.pt', 'lipnet_int8.pt'):
+        path = os.path.join(args.export_dir, name)
+        if(os.path.exists(path)):
+            variants.append(('ts_' + name[len('lipnet_'):-len('.pt')], load_torchscript(path)))
+    path = os.path.join(args.export_dir, 'lipnet_fp32.onnx')
+    if(os.path.exists(path)):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            print('onnxruntime not installed; skipping {}'.format(path))
+        else:
+            sess = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+            variants.append(('onnx_fp32', lambda vid: torch.from_numpy(sess.run(None, {'vid': vid.numpy()})[0])))
+    return variants
+
+
+def load_batches(args):
+    if(args.random):
+        T = [int(t) for t in np.random.RandomState(0).randint(40, 76, args.n)]
+        return [({'vid': example_input(t).expand(args.batch_size, -1, -1, -1, -1).contiguous(),
+            'vid_len': torch.LongTensor([t] * args.batch_size)}, None) for t in T]
+    opt = __import__('options')
+    dataset = MyDataset(opt.video_path, opt.anno_path, opt.val_list, None, None, 'test',
+        getattr(opt, 'frame_store', None))
+    idx = list(range(min(args.n * args.batch_size, len(dataset))))
+    batches = []
+    for i in range(0, len(idx), args.batch_size):
+        batch = MyDataset.collate([dataset[j] for j in idx[i:i + args.batch_size]])
+        batches.append((batch, MyDataset.batch_arr2txt(batch['txt'].numpy(), start=1)))
+    return batches
+
+
+if(__name__ == '__main__'):
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--weights', default=getattr(__import__('options'), 'weights', None),
+        help='the checkpoint export.py was run with; default: options.weights')
+    ap.add_argument('--export_dir', default='export')
+    ap.add_argument('--n', type=int, default=50, help='batches to time')
+    ap.add_argument('--batch_size', type=int, default=1)
+    ap.add_argument('--threads', type=int, default=0, help='torch intra-op threads; 0 keeps the default')
+    ap.add_argument('--random', action='store_true', help='random clips instead of the validation list')
+    args = ap.parse_args()
+    check_weights(ap, args)
+    if(args.threads):
+        torch.set_num_threads(args.threads)
+
+    batches = load_batches(args)
+    variants = load_variants(args)
+    results = {}
+    with torch.no_grad():
+        for (name, model) in variants:
+            model(batches[0][0]['vid'])
+            times, preds, logits = [], [], []
+            for (batch, _) in batches:
+                tic = time.perf_counter()
+                y = model(batch['vid'])
+                times.append(time.perf_counter() - tic)
+                preds.extend(MyDataset.ctc_decode(y, batch['vid_len']))
+                logits.append(y)
+            results[name] = (np.array(times), preds, logits)
+
+    (base_t, base_pred, base_logits) = results['eager_fp32']
+    n_clips = sum(len(b['vid']) for (b, _) in batches)
+    print('{:<12}{:>12}{:>10}{:>9}{:>12}{:>10}{:>10}'.format('variant', 'ms/batch', 'clips/s', 'speedup', 'same hyp', 'max|dy|', 'wer'))
+    for (name, (t, pred, logits)) in results.items():
+        same = np.mean([p == q for (p, q) in zip(pred, base_pred)])
+        dy = max((a - b).abs().max().item() for (a, b) in zip(logits, base_logits))
+        wer = '-'
+        if(batches[0][1] is not None):
+            truth = [s for (_, tr) in batches for s in tr]
+            wer = '{:.4f}'.format(np.mean(MyDataset.wer(pred, truth)))
+        print('{:<12}{:>12.1f}{:>10.1f}{:>9.2f}{:>12.3f}{:>10.4f}{:>10}'.format(
+            name, 1000 * np.median(t), n_clips / t.sum(), np.median(base_t) / np.median(t), same, dy, wer))
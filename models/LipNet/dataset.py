@@ -4,7 +4,7 @@ import glob
 import time
 import cv2
 import os
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 from cvtransforms import *
 import torch
 import glob
@@ -18,35 +18,51 @@ import editdistance
 class MyDataset(Dataset):
     letters = [' ', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z']
 
-    def __init__(self, video_path, anno_path, file_list, vid_pad, txt_pad, phase):
+    def __init__(self, video_path, anno_path, file_list, vid_pad, txt_pad, phase, store=None):
         self.anno_path = anno_path
         self.vid_pad = vid_pad
         self.txt_pad = txt_pad
         self.phase = phase
         
         with open(file_list, 'r') as f:
-            self.videos = [os.path.join(video_path, line.strip()) for line in f.readlines()]
+            self.videos = [os.path.join(video_path, line.strip()) for line in f.readlines() if line.strip()]
             
         self.data = []
         for vid in self.videos:
             items = vid.split(os.path.sep)            
             self.data.append((vid, items[-4], items[-1]))
+
+        # packed frames/alignments written by framestore.py; no JPEG decoding per item
+        self.store = None
+        if(store):
+            from framestore import FrameStore
+            self.store = FrameStore(store)
+            # store names are the list entries, i.e. the clip paths relative to video_path
+            root = os.path.join(video_path, '')
+            self.store_idx = [self.store.index(vid[len(root):]) for (vid, _, _) in self.data]
         
                 
     def __getitem__(self, idx):
-        (vid, spk, name) = self.data[idx]
-        vid = self._load_vid(vid)
-        anno = self._load_anno(os.path.join(self.anno_path, spk, 'align', name + '.align'))
+        if(self.store is not None):
+            i = self.store_idx[idx]
+            vid = self.store.vid(i)
+            anno = self.store.anno(i)
+        else:
+            (vid, spk, name) = self.data[idx]
+            vid = self._load_vid(vid)
+            anno = self._load_anno(os.path.join(self.anno_path, spk, 'align', name + '.align'))
 
         if(self.phase == 'train'):
             vid = HorizontalFlip(vid)
           
-        vid = ColorNormalize(vid)                   
+        vid = ColorNormalize(vid.astype(np.float32, copy=False))                   
         
         vid_len = vid.shape[0]
         anno_len = anno.shape[0]
-        vid = self._padding(vid, self.vid_pad)
-        anno = self._padding(anno, self.txt_pad)
+        # vid_pad=None leaves padding to MyDataset.collate (longest clip in the batch)
+        if(self.vid_pad):
+            vid = self._padding(vid, self.vid_pad)
+            anno = self._padding(anno, self.txt_pad)
         
         return {'vid': torch.FloatTensor(vid.transpose(3, 0, 1, 2)), 
             'txt': torch.LongTensor(anno),
@@ -55,18 +71,32 @@ class MyDataset(Dataset):
             
     def __len__(self):
         return len(self.data)
-        
-    def _load_vid(self, p): 
+
+    def lengths(self):
+        # frame counts for BucketBatchSampler, without decoding any clip: the store's packed lengths,
+        # else the frames _load_vid would keep, with cv2's header check standing in for imread's None
+        if(self.store is not None):
+            return [int(self.store.lengths[i]) for i in self.store_idx]
+        return [len([file for file in self._frame_files(vid) if cv2.haveImageReader(os.path.join(vid, file))])
+            for (vid, _, _) in self.data]
+
+    @staticmethod
+    def _frame_files(p):
         files = os.listdir(p)
         files = list(filter(lambda file: file.find('.jpg') != -1, files))
-        files = sorted(files, key=lambda file: int(os.path.splitext(file)[0]))
+        return sorted(files, key=lambda file: int(os.path.splitext(file)[0]))
+        
+    @staticmethod
+    def _load_vid(p, dtype=np.float32): 
+        files = MyDataset._frame_files(p)
         array = [cv2.imread(os.path.join(p, file)) for file in files]
         array = list(filter(lambda im: not im is None, array))
         array = [cv2.resize(im, (128, 64), interpolation=cv2.INTER_LANCZOS4) for im in array]
-        array = np.stack(array, axis=0).astype(np.float32)
+        array = np.stack(array, axis=0).astype(dtype)
         return array
     
-    def _load_anno(self, name):
+    @staticmethod
+    def _load_anno(name):
         with open(name, 'r') as f:
             lines = [line.strip().split(' ') for line in f.readlines()]
             txt = [line[2] for line in lines]
@@ -74,11 +104,22 @@ class MyDataset(Dataset):
         return MyDataset.txt2arr(' '.join(txt).upper(), 1)
     
     def _padding(self, array, length):
-        array = [array[_] for _ in range(array.shape[0])]
-        size = array[0].shape
-        for i in range(length - len(array)):
-            array.append(np.zeros(size))
-        return np.stack(array, axis=0)
+        out = np.zeros((max(length, array.shape[0]),) + array.shape[1:], dtype=array.dtype)
+        out[:array.shape[0]] = array
+        return out
+
+    @staticmethod
+    def collate(batch):
+        # pad to the longest clip/transcript in the batch with one preallocated tensor each
+        vid_len = torch.LongTensor([b['vid_len'] for b in batch])
+        txt_len = torch.LongTensor([b['txt_len'] for b in batch])
+        (c, _, h, w) = batch[0]['vid'].shape
+        vid = torch.zeros(len(batch), c, int(vid_len.max()), h, w)
+        txt = torch.zeros(len(batch), max(int(txt_len.max()), 1), dtype=torch.long)
+        for (i, b) in enumerate(batch):
+            vid[i, :, :b['vid_len']] = b['vid'][:, :b['vid_len']]
+            txt[i, :b['txt_len']] = b['txt'][:b['txt_len']]
+        return {'vid': vid, 'txt': txt, 'txt_len': txt_len, 'vid_len': vid_len}
     
     @staticmethod
     def txt2arr(txt, start):
@@ -95,6 +136,34 @@ class MyDataset(Dataset):
                 txt.append(MyDataset.letters[n - start])     
         return ''.join(txt).strip()
     
+    @staticmethod
+    def batch_arr2txt(arr, start, collapse_space=False):
+        # (B, T) ids -> B strings in one pass; ids < start are dropped. With collapse_space,
+        # runs of spaces become one, as ctc_arr2txt does after its repeat/blank filtering.
+        arr = np.asarray(arr)
+        (rows, cols) = np.nonzero(arr >= start)
+        tok = arr[rows, cols] - start
+        if(collapse_space):
+            dup = np.zeros(len(tok), dtype=bool)
+            dup[1:] = (tok[1:] == 0) & (tok[:-1] == 0) & (rows[1:] == rows[:-1])
+            (rows, tok) = (rows[~dup], tok[~dup])
+        chars = np.frombuffer(''.join(MyDataset.letters).encode(), dtype=np.uint8)[tok]
+        text = chars.tobytes().decode()
+        bounds = np.searchsorted(rows, np.arange(arr.shape[0] + 1))
+        return [text[bounds[i]:bounds[i + 1]].strip() for i in range(arr.shape[0])]
+
+    @staticmethod
+    def ctc_decode(y, vid_len=None):
+        # greedy CTC on device (argmax, drop repeats and blanks, ignore padded frames),
+        # then a single host transfer for the whole batch
+        y = y.argmax(-1)
+        keep = torch.ones_like(y, dtype=torch.bool)
+        keep[:, 1:] = y[:, 1:] != y[:, :-1]
+        if(vid_len is not None):
+            keep &= torch.arange(y.size(1), device=y.device).unsqueeze(0) < vid_len.view(-1, 1).to(y.device)
+        y = y.masked_fill(~keep, 0).cpu().numpy()
+        return MyDataset.batch_arr2txt(y, start=1, collapse_space=True)
+
     @staticmethod
     def ctc_arr2txt(arr, start):
         pre = -1
@@ -118,3 +187,49 @@ class MyDataset(Dataset):
     def cer(predict, truth):        
         cer = [1.0*editdistance.eval(p[0], p[1])/len(p[1]) for p in zip(predict, truth)]
         return cer
+
+
+class BucketBatchSampler(Sampler):
+    """Batches of clips with similar frame counts.
+
+    Indices are shuffled, cut into buckets of bucket_size batches, sorted by length
+    within each bucket and split into batches; the batch order is then shuffled.
+    """
+
+    def __init__(self, lengths, batch_size, shuffle=True, drop_last=False, bucket_size=50):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.bucket_size = max(1, bucket_size)
+
+    def _batches(self, rng):
+        idx = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        span = self.batch_size * self.bucket_size
+        batches = []
+        for i in range(0, len(idx), span):
+            chunk = idx[i:i + span]
+            chunk = chunk[np.argsort(self.lengths[chunk], kind='stable')]
+            batches.extend(chunk[j:j + self.batch_size] for j in range(0, len(chunk), self.batch_size))
+        if(self.drop_last):
+            batches = [b for b in batches if len(b) == self.batch_size]
+        if(self.shuffle):
+            batches = [batches[k] for k in rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        for b in self._batches(np.random):
+            yield b.tolist()
+
+    def __len__(self):
+        span = self.batch_size * self.bucket_size
+        (full, rest) = divmod(len(self.lengths), span)
+        per_bucket = span // self.batch_size
+        if(self.drop_last):
+            return full * per_bucket + rest // self.batch_size
+        return full * per_bucket + (rest + self.batch_size - 1) // self.batch_size
+
+    def padding_ratio(self, seed=0):
+        # real frames / padded frames over one epoch, from a private RNG
+        l = [self.lengths[b] for b in self._batches(np.random.RandomState(seed))]
+        return sum(x.sum() for x in l) / max(sum(x.max() * len(x) for x in l), 1)
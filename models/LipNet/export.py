@@ -0,0 +1,76 @@
+import argparse
+import os
+import torch
+import torch.nn as nn
+from model import LipNet
+
+# CPU inference graphs of LipNet. Input vid is (B, 3, T, 64, 128) in [0, 1], output
+# logits (B, T, 28); batch and time are dynamic in every exported graph.
+
+
+def load_model(weights):
+    # eager CPU model, loading weights the way main.py does (matching keys only); always from a
+    # checkpoint, so export.py and cpu_benchmark.py compare graphs of the same network
+    model = LipNet().eval()
+    pretrained_dict = torch.load(weights, map_location='cpu')
+    model_dict = model.state_dict()
+    pretrained_dict = {k: v for k, v in pretrained_dict.items() if k in model_dict.keys() and v.size() == model_dict[k].size()}
+    print('loaded params/tot params:{}/{}'.format(len(pretrained_dict),len(model_dict)))
+    if(len(pretrained_dict) == 0):
+        raise ValueError('no parameters of {} match LipNet'.format(weights))
+    model_dict.update(pretrained_dict)
+    model.load_state_dict(model_dict)
+    return model
+
+
+def check_weights(ap, args):
+    if(not args.weights or not os.path.exists(args.weights)):
+        ap.error('--weights must name a trained checkpoint (got {!r})'.format(args.weights))
+
+
+def quantize(model):
+    # int8 weights for the two bidirectional GRUs and the FC head; the 3D convs stay fp32
+    return torch.ao.quantization.quantize_dynamic(model, {nn.GRU, nn.Linear}, dtype=torch.qint8)
+
+
+def example_input(T=75):
+    return torch.rand(1, 3, T, 64, 128)
+
+
+def export_torchscript(model, path):
+    # traced (sizes are read at run time, so T stays dynamic) and frozen
+    with torch.no_grad():
+        graph = torch.jit.freeze(torch.jit.trace(model.eval(), example_input(), check_trace=False))
+    torch.jit.save(graph, path)
+    return path
+
+
+def load_torchscript(path):
+    # conv/bn fusion and oneDNN layouts are applied after loading; the optimized
+    # graph holds prepacked CPU weights and cannot itself be serialized
+    return torch.jit.optimize_for_inference(torch.jit.load(path, map_location='cpu'))
+
+
+def export_onnx(model, path, opset=17):
+    torch.onnx.export(model.eval(), (example_input(),), path,
+        input_names=['vid'], output_names=['logits'],
+        dynamic_axes={'vid': {0: 'batch', 2: 'time'}, 'logits': {0: 'batch', 1: 'time'}},
+        opset_version=opset)
+    return path
+
+
+if(__name__ == '__main__'):
+    opt = __import__('options')
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--weights', default=getattr(opt, 'weights', None), help='checkpoint to export; default: options.weights')
+    ap.add_argument('--out_dir', default='export')
+    ap.add_argument('--onnx', action='store_true', help='also write the fp32 ONNX graph (dynamically quantized GRUs do not export to ONNX)')
+    args = ap.parse_args()
+    check_weights(ap, args)
+
+    if(not os.path.exists(args.out_dir)): os.makedirs(args.out_dir)
+    model = load_model(args.weights)
+    print(export_torchscript(model, os.path.join(args.out_dir, 'lipnet_fp32.pt')))
+    print(export_torchscript(quantize(model), os.path.join(args.out_dir, 'lipnet_int8.pt')))
+    if(args.onnx):
+        print(export_onnx(model, os.path.join(args.out_dir, 'lipnet_fp32.onnx')))
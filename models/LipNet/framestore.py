@@ -0,0 +1,117 @@
+# encoding: utf-8
+import os
+import json
+import argparse
+import numpy as np
+from multiprocessing import Pool
+from dataset import MyDataset
+
+# Packed clip store: every clip's resized uint8 frames back to back in one raw file,
+# plus an index mapping each file-list entry to its frame and alignment slices.
+#   frames.u8  - uint8 (total_frames, 64, 128, 3), BGR as read by cv2
+#   index.npz  - names, offsets, lengths, txt (uint8 letter ids), txt_offsets, txt_lengths
+#   meta.json  - frame shape and counts
+FRAME_SHAPE = (64, 128, 3)
+
+
+class FrameStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        idx = np.load(os.path.join(path, 'index.npz'))
+        self.names = [str(n) for n in idx['names']]
+        self.offsets = idx['offsets']
+        self.lengths = idx['lengths']
+        self.txt = idx['txt']
+        self.txt_offsets = idx['txt_offsets']
+        self.txt_lengths = idx['txt_lengths']
+        self.pos = {n: i for (i, n) in enumerate(self.names)}
+        self._frames = None
+
+    def __getstate__(self):
+        # DataLoader workers reopen the memmap instead of pickling its pages
+        state = self.__dict__.copy()
+        state['_frames'] = None
+        return state
+
+    @property
+    def frames(self):
+        if(self._frames is None):
+            total = int(self.offsets[-1] + self.lengths[-1]) if len(self.offsets) else 0
+            self._frames = np.memmap(os.path.join(self.path, 'frames.u8'), dtype=np.uint8, mode='r',
+                shape=(total,) + FRAME_SHAPE)
+        return self._frames
+
+    def index(self, name):
+        if(name not in self.pos):
+            raise KeyError('{} is not in frame store {}'.format(name, self.path))
+        return self.pos[name]
+
+    def vid(self, i):
+        # zero-copy view of the clip's uint8 frames
+        o = self.offsets[i]
+        return self.frames[o:o + self.lengths[i]]
+
+    def anno(self, i):
+        o = self.txt_offsets[i]
+        return self.txt[o:o + self.txt_lengths[i]].astype(np.int64)
+
+
+def _load_clip(job):
+    (name, video_path, anno_path) = job
+    vid = os.path.join(video_path, name)
+    items = vid.split(os.path.sep)
+    frames = MyDataset._load_vid(vid, dtype=np.uint8)
+    anno = MyDataset._load_anno(os.path.join(anno_path, items[-4], 'align', items[-1] + '.align'))
+    return (name, frames, anno)
+
+
+def pack(video_path, anno_path, file_lists, out_dir, workers=1):
+    names = []
+    for file_list in file_lists:
+        with open(file_list, 'r') as f:
+            names.extend(line.strip() for line in f if line.strip())
+    names = list(dict.fromkeys(names))
+    if(not os.path.exists(out_dir)): os.makedirs(out_dir)
+
+    lengths, txts = [], []
+    jobs = [(n, video_path, anno_path) for n in names]
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        clips = pool.imap(_load_clip, jobs, chunksize=8) if pool else map(_load_clip, jobs)
+        with open(os.path.join(out_dir, 'frames.u8'), 'wb') as f:
+            for (i, (name, frames, anno)) in enumerate(clips):
+                f.write(np.ascontiguousarray(frames).tobytes())
+                lengths.append(len(frames))
+                txts.append(anno.astype(np.uint8))
+                if(i % 1000 == 0):
+                    print('packed {}/{}'.format(i, len(jobs)))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    lengths = np.asarray(lengths, dtype=np.int64)
+    txt_lengths = np.asarray([len(t) for t in txts], dtype=np.int64)
+    np.savez(os.path.join(out_dir, 'index.npz'),
+        names=np.asarray(names),
+        offsets=np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64),
+        lengths=lengths,
+        txt=np.concatenate(txts) if txts else np.zeros(0, np.uint8),
+        txt_offsets=np.concatenate([[0], np.cumsum(txt_lengths)[:-1]]).astype(np.int64),
+        txt_lengths=txt_lengths)
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump({'frame_shape': FRAME_SHAPE, 'clips': len(names), 'frames': int(lengths.sum())}, f)
+    print('packed {} clips, {} frames into {}'.format(len(names), int(lengths.sum()), out_dir))
+
+
+if(__name__ == '__main__'):
+    opt = __import__('options')
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--video_path', default=opt.video_path)
+    ap.add_argument('--anno_path', default=opt.anno_path)
+    ap.add_argument('--file_list', nargs='+', default=[opt.train_list, opt.val_list])
+    ap.add_argument('--out_dir', required=True)
+    ap.add_argument('--workers', type=int, default=opt.num_workers)
+    args = ap.parse_args()
+    pack(args.video_path, args.anno_path, args.file_list, args.out_dir, args.workers)
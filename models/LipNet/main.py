@@ -6,13 +6,14 @@ from torch.utils.data import DataLoader
 import math
 import os
 import sys
-from dataset import MyDataset
+from dataset import MyDataset, BucketBatchSampler
 import numpy as np
 import time
 from model import LipNet
 import torch.optim as optim
 import re
 import json
+from concurrent.futures import ThreadPoolExecutor
 from tensorboardX import SummaryWriter
 
 
@@ -22,11 +23,24 @@ if(__name__ == '__main__'):
     writer = SummaryWriter()
 
 def dataset2dataloader(dataset, num_workers=opt.num_workers, shuffle=True):
+    if(not getattr(opt, 'dynamic_padding', False)):
+        return DataLoader(dataset,
+            batch_size = opt.batch_size, 
+            shuffle = shuffle,
+            num_workers = num_workers,
+            drop_last = False)
+    lengths = dataset.lengths()
+    sampler = BucketBatchSampler(lengths, opt.batch_size, shuffle=shuffle, bucket_size=opt.bucket_size)
+    print('real/padded frames:{:.3f} (fixed vid_padding:{:.3f})'.format(
+        sampler.padding_ratio(), 1.0*sum(lengths)/max(len(lengths)*opt.vid_padding, 1)))
     return DataLoader(dataset,
-        batch_size = opt.batch_size, 
-        shuffle = shuffle,
+        batch_sampler = sampler,
         num_workers = num_workers,
-        drop_last = False)
+        collate_fn = MyDataset.collate)
+
+def vid_padding():
+    # None: MyDataset.collate pads each batch to its longest clip
+    return None if getattr(opt, 'dynamic_padding', False) else opt.vid_padding
 
 def show_lr(optimizer):
     lr = []
@@ -34,24 +48,50 @@ def show_lr(optimizer):
         lr += [param_group['lr']]
     return np.array(lr).mean()  
 
-def ctc_decode(y):
-    result = []
-    y = y.argmax(-1)
-    return [MyDataset.ctc_arr2txt(y[_], start=1) for _ in range(y.size(0))]
+def ctc_decode(y, vid_len=None):
+    return MyDataset.ctc_decode(y, vid_len)
+
+def train_metrics(y, vid_len, txt, loss, train_wer, epoch, tot_iter, eta):
+    # runs every opt.display steps, optionally on the metrics thread
+    pred_txt = ctc_decode(y, vid_len)
+    truth_txt = MyDataset.batch_arr2txt(txt.numpy(), start=1)
+    train_wer.extend(MyDataset.wer(pred_txt, truth_txt))
+
+    writer.add_scalar('train loss', loss, tot_iter)
+    writer.add_scalar('train wer', np.array(train_wer).mean(), tot_iter)
+    print(''.join(101*'-'))                
+    print('{:<50}|{:>50}'.format('predict', 'truth'))                
+    print(''.join(101*'-'))
+
+    for (predict, truth) in list(zip(pred_txt, truth_txt))[:3]:
+        print('{:<50}|{:>50}'.format(predict, truth))
+    print(''.join(101*'-'))                
+    print('epoch={},tot_iter={},eta={},loss={},train_wer={}'.format(epoch, tot_iter, eta, loss, np.array(train_wer).mean()))
+    print(''.join(101*'-'))
     
-def test(model, net):
+# val loader, built on the first test(): clip lengths, batches and padding stats are computed once per run
+_test_loader = None
 
-    with torch.no_grad():
+def test_loader():
+    global _test_loader
+    if(_test_loader is None):
         dataset = MyDataset(opt.video_path,
             opt.anno_path,
             opt.val_list,
-            opt.vid_padding,
+            vid_padding(),
             opt.txt_padding,
-            'test')
+            'test',
+            getattr(opt, 'frame_store', None))
             
         print('num_test_data:{}'.format(len(dataset.data)))  
+        _test_loader = dataset2dataloader(dataset, shuffle=False)
+    return _test_loader
+
+def test(model, net):
+
+    with torch.no_grad():
         model.eval()
-        loader = dataset2dataloader(dataset, shuffle=False)
+        loader = test_loader()
         loss_list = []
         wer = []
         cer = []
@@ -67,9 +107,9 @@ def test(model, net):
             
             loss = crit(y.transpose(0, 1).log_softmax(-1), txt, vid_len.view(-1), txt_len.view(-1)).detach().cpu().numpy()
             loss_list.append(loss)
-            pred_txt = ctc_decode(y)
+            pred_txt = ctc_decode(y, vid_len)
             
-            truth_txt = [MyDataset.arr2txt(txt[_], start=1) for _ in range(txt.size(0))]
+            truth_txt = MyDataset.batch_arr2txt(input.get('txt').numpy(), start=1)
             wer.extend(MyDataset.wer(pred_txt, truth_txt)) 
             cer.extend(MyDataset.cer(pred_txt, truth_txt))              
             if(i_iter % opt.display == 0):
@@ -92,9 +132,10 @@ def train(model, net):
     dataset = MyDataset(opt.video_path,
         opt.anno_path,
         opt.train_list,
-        opt.vid_padding,
+        vid_padding(),
         opt.txt_padding,
-        'train')
+        'train',
+        getattr(opt, 'frame_store', None))
         
     loader = dataset2dataloader(dataset) 
     optimizer = optim.Adam(model.parameters(),
@@ -107,6 +148,9 @@ def train(model, net):
     tic = time.time()
     
     train_wer = []
+    # decode/WER of the sampled batch off the training thread; at most one in flight
+    executor = ThreadPoolExecutor(max_workers=1) if getattr(opt, 'metrics_thread', False) else None
+    pending = None
     for epoch in range(opt.max_epoch):
         for (i_iter, input) in enumerate(loader):
             model.train()
@@ -124,26 +168,16 @@ def train(model, net):
             
             tot_iter = i_iter + epoch*len(loader)
             
-            pred_txt = ctc_decode(y)
-            
-            truth_txt = [MyDataset.arr2txt(txt[_], start=1) for _ in range(txt.size(0))]
-            train_wer.extend(MyDataset.wer(pred_txt, truth_txt))
-            
             if(tot_iter % opt.display == 0):
                 v = 1.0*(time.time()-tic)/(tot_iter+1)
                 eta = (len(loader)-i_iter)*v/3600.0
-                
-                writer.add_scalar('train loss', loss, tot_iter)
-                writer.add_scalar('train wer', np.array(train_wer).mean(), tot_iter)              
-                print(''.join(101*'-'))                
-                print('{:<50}|{:>50}'.format('predict', 'truth'))                
-                print(''.join(101*'-'))
-                
-                for (predict, truth) in list(zip(pred_txt, truth_txt))[:3]:
-                    print('{:<50}|{:>50}'.format(predict, truth))
-                print(''.join(101*'-'))                
-                print('epoch={},tot_iter={},eta={},loss={},train_wer={}'.format(epoch, tot_iter, eta, loss, np.array(train_wer).mean()))
-                print(''.join(101*'-'))
+                args = (y.detach(), vid_len, input.get('txt'), loss.item(), train_wer, epoch, tot_iter, eta)
+                if(executor is None):
+                    train_metrics(*args)
+                else:
+                    if(pending is not None):
+                        pending.result()
+                    pending = executor.submit(train_metrics, *args)
                 
             if(tot_iter % opt.test_step == 0):                
                 (loss, wer, cer) = test(model, net)
@@ -5,13 +5,17 @@ video_path = 'lip/'
 train_list = f'data/{data_type}_train.txt'
 val_list = f'data/{data_type}_val.txt'
 anno_path = 'GRID_align_txt'
+frame_store = None  # directory written by framestore.py; None decodes the JPEG folders
 vid_padding = 75
 txt_padding = 200
+dynamic_padding = True  # pad each batch to its longest clip instead of vid_padding/txt_padding
+bucket_size = 50  # batches per length-sorted bucket when dynamic_padding is on
 batch_size = 96
 base_lr = 2e-5
 num_workers = 16
 max_epoch = 10000
 display = 10
+metrics_thread = False  # decode/WER of the display batch on a background thread
 test_step = 1000
 save_prefix = f'weights/LipNet_{data_type}'
 is_optimize = True
@@ -1,62 +1,152 @@
-from scipy.misc import imsave
-import dlib
 import os
-import glob
+import wave
+import argparse
+import shutil
+import subprocess
 import numpy as np
 import cv2
 from multiprocessing import Pool
-import pdb
-from torch.utils.data import DataLoader, Dataset
 import time
 
+try:
+    import av
+except ImportError:
+    av = None
 
-class MyDataset(Dataset):
-    
-    def __init__(self):
-        self.IN = 'GRID/'
-        self.OUT = 'GRID_imgs/'
-
-        self.wav = 'GRID_wavs/'
-
-        with open('GRID_files.txt', 'r') as f:
-            files = [line.strip() for line in f.readlines()]
-            self.files = []
-            for file in files:  
-                _, ext = os.path.splitext(file)
-                if(ext == '.XML'): continue
-                self.files.append(file)
-                print(file)
-                wav = file.replace(self.IN, self.wav).replace(ext, '.wav')
-                path = os.path.split(wav)[0]      
-                if(not os.path.exists(path)): 
-                    os.makedirs(path)
-
-                    
-    def __len__(self):
-        return len(self.files)
-        
-    def __getitem__(self, idx):
-        file = self.files[idx]
-        _, ext = os.path.splitext(file)
-        dst = file.replace(self.IN, self.OUT).replace(ext, '')
+FPS = 25
+SR = 16000
 
-        if(not os.path.exists(dst)): 
-            os.makedirs(dst)
 
-        cmd = 'ffmpeg -i \'{}\' -qscale:v 2 -r 25 \'{}/%d.jpg\''.format(file, dst)
-       
-        os.system(cmd)
+def resample_fps(frames, fps):
+    # nearest-earlier frame at FPS, as ffmpeg -r does for a constant-rate source
+    if(abs(fps - FPS) < 1e-3 or len(frames) == 0):
+        return frames
+    n = max(1, int(round(len(frames) * FPS / fps)))
+    idx = np.minimum((np.arange(n) * fps / FPS).astype(np.int64), len(frames) - 1)
+    return frames[idx]
+
+
+def decode(file):
+    # one pass over the container -> (uint8 (T, H, W, 3) BGR frames, int16 16 kHz mono audio or None)
+    frames, audio = [], None
+    if(av is not None):
+        with av.open(file) as container:
+            video = container.streams.video[0]
+            streams = [video] + list(container.streams.audio[:1])
+            resampler = av.AudioResampler(format='s16', layout='mono', rate=SR)
+            chunks = []
+            for frame in container.decode(*streams):
+                if(isinstance(frame, av.VideoFrame)):
+                    frames.append(frame.to_ndarray(format='bgr24'))
+                else:
+                    chunks.extend(resampler.resample(frame))
+            if(len(streams) > 1):
+                chunks.extend(resampler.resample(None))
+                audio = np.concatenate([c.to_ndarray().reshape(-1) for c in chunks]) if chunks else np.zeros(0, np.int16)
+            fps = float(video.average_rate or FPS)
+    else:
+        cap = cv2.VideoCapture(file)
+        fps = cap.get(cv2.CAP_PROP_FPS) or FPS
+        while True:
+            (ok, frame) = cap.read()
+            if(not ok): break
+            frames.append(frame)
+        cap.release()
+    if(len(frames) == 0):
+        raise IOError('no frames decoded from {}'.format(file))
+    return resample_fps(np.stack(frames), fps), audio
+
+
+def has_audio(file):
+    if(av is not None):
+        with av.open(file) as container:
+            return len(container.streams.audio) > 0
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'a', '-show_entries', 'stream=index', '-of', 'csv=p=0', file]
+    return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout.strip() != ''
+
+
+def write_wav(path, audio):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SR)
+        f.writeframes(audio.astype('<i2').tobytes())
 
-        wav = file.replace(self.IN, self.wav).replace(ext, '.wav')    
+
+def extract_array(job):
+    # frames -> <out>/<clip>.npy, audio -> <wav>/<clip>.wav (none for a video without audio); written
+    # via temp files, the .npy last, so a killed run never leaves a clip that looks complete
+    (file, dst, wav, overwrite) = job
+    if(not overwrite and os.path.exists(dst)):
+        return 0
+    for path in (dst, wav):
+        dir = os.path.split(path)[0]
+        if(not os.path.exists(dir)): os.makedirs(dir, exist_ok=True)
+    frames, audio = decode(file)
+    with open(dst + '.tmp', 'wb') as f:
+        np.save(f, frames)
+    if(audio is not None):
+        write_wav(wav + '.tmp', audio)
+    elif(av is None and has_audio(file)):
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-i', file, '-async', '1', '-ac', '1', '-vn',
+            '-acodec', 'pcm_s16le', '-ar', str(SR), '-f', 'wav', wav + '.tmp']
+        subprocess.run(cmd, check=True)
+    if(os.path.exists(wav + '.tmp')):
+        os.replace(wav + '.tmp', wav)
+    os.replace(dst + '.tmp', dst)
+    return len(frames)
+
+
+def extract_jpeg(job):
+    # legacy layout: lossy JPEG per frame plus the wav, via two ffmpeg calls; the frames go to a
+    # temp dir renamed to dst last, so an existing dst is a finished clip
+    (file, dst, wav, overwrite) = job
+    if(not overwrite and os.path.exists(dst)):
+        return 0
+    tmp = dst + '.tmp'
+    for dir in (dst, tmp):
+        if(os.path.exists(dir)): shutil.rmtree(dir)
+    for dir in (tmp, os.path.split(wav)[0]):
+        if(not os.path.exists(dir)): os.makedirs(dir, exist_ok=True)
+
+    if(has_audio(file)):
         cmd = 'ffmpeg -y -i \'{}\' -async 1 -ac 1 -vn -acodec pcm_s16le -ar 16000 \'{}\' '.format(file, wav)
         os.system(cmd)
 
-        return dst
+    cmd = 'ffmpeg -i \'{}\' -qscale:v 2 -r 25 \'{}/%d.jpg\''.format(file, tmp)
+    os.system(cmd)
+    os.replace(tmp, dst)
+    return len(os.listdir(dst))
+
+
+if(__name__ == '__main__'):
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--list', default='GRID_files.txt')
+    ap.add_argument('--src', default='GRID/')
+    ap.add_argument('--out', default='GRID_imgs/')
+    ap.add_argument('--wav', default='GRID_wavs/')
+    ap.add_argument('--mode', choices=['array', 'jpeg'], default='array',
+        help='array: one uint8 (T, H, W, 3) .npy per video; jpeg: the old per-frame JPEG dump')
+    ap.add_argument('--workers', type=int, default=os.cpu_count())
+    ap.add_argument('--overwrite', action='store_true', help='re-extract videos whose outputs already exist')
+    args = ap.parse_args()
+
+    with open(args.list, 'r') as f:
+        files = [line.strip() for line in f.readlines()]
+    jobs = []
+    for file in files:
+        _, ext = os.path.splitext(file)
+        if(ext == '.XML' or not file): continue
+        dst = file.replace(args.src, args.out).replace(ext, '.npy' if args.mode == 'array' else '')
+        wav = file.replace(args.src, args.wav).replace(ext, '.wav')
+        jobs.append((file, dst, wav, args.overwrite))
 
-if(__name__ == '__main__'):   
-    dataset = MyDataset()
-    loader = DataLoader(dataset, num_workers=32, batch_size=128, shuffle=False, drop_last=False)
+    fn = extract_array if args.mode == 'array' else extract_jpeg
     tic = time.time()
-    for (i, batch) in enumerate(loader):
-        eta = (1.0*time.time()-tic)/(i+1) * (len(loader)-i)
-        print('eta:{}'.format(eta/3600.0))
+    n_frames = 0
+    with Pool(args.workers) as pool:
+        for (i, n) in enumerate(pool.imap_unordered(fn, jobs), 1):
+            n_frames += n
+            if(i % 100 == 0 or i == len(jobs)):
+                t = time.time() - tic
+                print('videos={}/{},frames/s={:.1f},eta:{}'.format(i, len(jobs), n_frames / t, t / i * (len(jobs) - i) / 3600.0))
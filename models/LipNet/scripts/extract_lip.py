@@ -1,9 +1,11 @@
 import cv2
 import json
 import numpy as np
-from multiprocessing import Pool, Process, Queue
+from multiprocessing import Pool
+import argparse
 import time
 import os
+import landmarks
 
 
 def get_position(size, padding=0.25):
@@ -37,105 +39,99 @@ def cal_area(anno):
 
 
 def transformation_from_points(points1, points2):
-    points1 = points1.astype(np.float64)
-    points2 = points2.astype(np.float64)
- 
-    c1 = np.mean(points1, axis=0)
-    c2 = np.mean(points2, axis=0)
-    points1 -= c1
-    points2 -= c2
-    s1 = np.std(points1)
-    s2 = np.std(points2)
-    points1 /= s1
-    points2 /= s2
- 
-    U, S, Vt = np.linalg.svd(points1.T * points2)
-    R = (U * Vt).T
-    return np.vstack([np.hstack(((s2 / s1) * R,
-                                       c2.T - (s2 / s1) * R * c1.T)),
-                         np.matrix([0., 0., 1.])])
+    # batched Procrustes: points1 (N, K, 2) per-frame shapes, points2 (K, 2) template
+    # -> (N, 2, 3) affine matrices mapping each shape onto the template
+    points1 = np.asarray(points1, dtype=np.float64)
+    points2 = np.asarray(points2, dtype=np.float64)
 
+    c1 = points1.mean(axis=1, keepdims=True)
+    c2 = points2.mean(axis=0)
+    points1 = points1 - c1
+    points2 = points2 - c2
+    s1 = points1.std(axis=(1, 2))
+    s2 = points2.std()
+    points1 /= s1[:, None, None]
+    points2 /= s2
 
+    U, S, Vt = np.linalg.svd(np.einsum('nki,kj->nij', points1, points2))
+    R = np.matmul(U, Vt).transpose(0, 2, 1)
+    A = (s2 / s1)[:, None, None] * R
+    t = c2 - np.einsum('nij,nj->ni', A, c1[:, 0])
+    return np.concatenate([A, t[:, :, None]], axis=2)
 
-    
-def anno_img(img_dir, anno_dir, save_dir):
 
-    files = list(os.listdir(img_dir))
-    files = [file for file in files if(file.find('.jpg') != -1)]
+def load_shapes(anno_dir, files):
+    # largest face per frame, mouth/jaw-free 51 points; None if any frame has no face
+    path = os.path.join(anno_dir, landmarks.NAME)
+    if(os.path.exists(path)):
+        frames, faces = landmarks.load(path)
+        faces = dict(zip(frames, faces))
+        faces = [faces.get(file, []) for file in files]
+    else:
+        faces = [landmarks.parse_txt(os.path.join(anno_dir, file).replace('.jpg', '.txt')) for file in files]
     shapes = []
-    for file in files:
-        img = os.path.join(img_dir, file)
-        anno = os.path.join(anno_dir, file).replace('.jpg', '.txt')
-           
-        I = cv2.imread(img)
-        count = 0
-    
-        with open(anno, 'r') as f:
-            annos = [line.strip().split('\t') for line in f.readlines()]
-            if(len(annos) == 0): return
-            for (i, anno) in enumerate(annos):
-                x, y = [], []
-                for p in anno:
-                    _, __ = p[1:-1].split(',')
-                    _, __ = float(_), float(__)
-                    x.append(_)
-                    y.append(__)   
-                annos[i] = np.stack([x, y], 1)
-                
-        anno = sorted(annos, key = cal_area, reverse=True)[0]        
-        shape = []
-        
-        shapes.append(anno[17:])
-        
-    
-    front256 = get_position(256)
-    M_prev = None
-    for (shape, file) in zip(shapes, files):
-        img = os.path.join(img_dir, file)
-        I = cv2.imread(img)
-        M = transformation_from_points(np.matrix(shape), np.matrix(front256))
-        img = cv2.warpAffine(I, M[:2], (256, 256))
-        (x, y) = front256[-20:].mean(0).astype(np.int32)
-        w = 160//2
+    for annos in faces:
+        if(len(annos) == 0): return None
+        shapes.append(sorted(annos, key = cal_area, reverse=True)[0][17:])
+    return np.stack(shapes)
+
+
+front256 = get_position(256)
+
+def anno_img(job):
+    (img_dir, anno_dir, save_dir) = job
+    if(img_dir.endswith('.npy')):
+        # extract_frame.py array; frames are named as the JPEG dump would name them
+        frames = np.load(img_dir, mmap_mode='r')
+        files = ['{}.jpg'.format(i + 1) for i in range(len(frames))]
+    else:
+        frames = None
+        files = list(os.listdir(img_dir))
+        files = [file for file in files if(file.find('.jpg') != -1)]
+    shapes = load_shapes(anno_dir, files)
+    if(shapes is None or len(files) == 0): return 0
+
+    Ms = transformation_from_points(shapes, front256)
+    (x, y) = front256[-20:].mean(0).astype(np.int32)
+    w = 160//2
+    for (i, (M, file)) in enumerate(zip(Ms, files)):
+        I = cv2.imread(os.path.join(img_dir, file)) if frames is None else np.asarray(frames[i])
+        img = cv2.warpAffine(I, M, (256, 256))
         img = img[y-w//2:y+w//2,x-w:x+w,...]
         cv2.imwrite(os.path.join(save_dir, file), img)
+    return len(files)
 
 
-def run(files):
-    tic = time.time()
-    count = 0
-    print('n_files:{}'.format(len(files)))
-    for (img_dir, anno_dir, save_dir) in files:
-        anno_img(img_dir, anno_dir, save_dir)
-        count += 1
-        if(count % 1000 == 0):
-            print('eta={}'.format((time.time()-tic)/(count) * (len(files) - count) / 3600.0))
-
 if(__name__ == '__main__'):
-    with open('grid.txt', 'r') as f:
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--list', default='grid.txt', help='frame files (one clip per directory) and/or clip .npy arrays')
+    ap.add_argument('--src', default='GRID/6k_video_imgs')
+    ap.add_argument('--landmarks', default='GRID/landmarks')
+    ap.add_argument('--dst', default='GRID/lip')
+    ap.add_argument('--workers', type=int, default=os.cpu_count())
+    args = ap.parse_args()
+
+    with open(args.list, 'r') as f:
         data = [line.strip() for line in f.readlines()]
-        data = list(set([os.path.split(file)[0] for file in data]))
+        data = list(set([file if file.endswith('.npy') else os.path.split(file)[0] for file in data if file]))
 
-    
-    annos = [name.replace('GRID/6k_video_imgs', 'GRID/landmarks') for name in data]  
-    targets = [name.replace('GRID/6k_video_imgs', 'GRID/lip') for name in data]  
+    clips = [name[:-len('.npy')] if name.endswith('.npy') else name for name in data]
+    annos = [name.replace(args.src, args.landmarks) for name in clips]  
+    targets = [name.replace(args.src, args.dst) for name in clips]  
     
     for dst in targets:
         if(not os.path.exists(dst)):
             os.makedirs(dst)
     
     data = list(zip(data, annos, targets))
-    processes = []
-    n_p = 8
-    bs = len(data) // n_p
-    for i in range(n_p):
-        if(i == n_p - 1):
-            bs = len(data)
-        p = Process(target=run, args=(data[:bs],))
-        data = data[bs:]
-        p.start()
-        processes.append(p)
-        
-    assert(len(data) == 0)
-    for p in processes:
-        p.join()
+    print('n_clips:{},workers:{}'.format(len(data), args.workers))
+    tic = time.time()
+    n_frames = 0
+    # one clip per task, handed out as workers free up
+    with Pool(args.workers) as pool:
+        for (count, n) in enumerate(pool.imap_unordered(anno_img, data), 1):
+            n_frames += n
+            if(count % 1000 == 0 or count == len(data)):
+                t = time.time() - tic
+                print('clips={}/{},frames/s={:.1f},eta={}'.format(count, len(data), n_frames / t,
+                    t / count * (len(data) - count) / 3600.0))
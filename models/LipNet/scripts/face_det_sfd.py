@@ -1,55 +1,115 @@
-import sys
-import dlib
 import os
 import cv2
+import argparse
+import numpy as np
+import torch
 import face_alignment
-from multiprocessing import Pool, Process, Queue
+import multiprocessing as mp
 import time
+import landmarks
 
 
-def run(gpu, files):
-    os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu)
-    fa = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, flip_input=False, device='cuda')
-    print('gpu={},n_files={}'.format(gpu, len(files)))
-    tic = time.time()
-    count = 0
-    for (img_name, savename) in files:
-        I = cv2.imread(img_name)
-        points_list = fa.get_landmarks(I)
-        
-        with open(savename, 'w') as f:
-            if(points_list is not None):
-                for points in points_list:
-                    for (x, y) in points:
-                        f.write('({}, {})\t'.format(x, y))
-                    f.write('\n')
-
-        count += 1
-        if(count % 1000 == 0):
-            print('dst={},eta={}'.format(savename, (time.time()-tic)/(count) * (len(files) - count) / 3600.0))
-       
+# per-process detector, built once by init_worker on the device picked for that worker
+fa = None
+
+def init_worker(devices, counter):
+    global fa
+    with counter.get_lock():
+        k = counter.value
+        counter.value += 1
+    try:
+        fa = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, flip_input=False, device=devices[k % len(devices)])
+    except Exception as e:
+        # a raising initializer makes Pool respawn workers forever; fail on first task instead
+        fa = e
+
+
+def load_clip(src):
+    # a clip is a frame directory of %d.jpg (frames listed) or an extract_frame.py .npy array
+    (path, files) = src
+    if(path.endswith('.npy')):
+        frames = np.load(path, mmap_mode='r')
+        return ['{}.jpg'.format(i + 1) for i in range(len(frames))], frames
+    return files, [cv2.imread(os.path.join(path, file)) for file in files]
+
+
+def face_points(points):
+    # detector output for one frame (None: no face) -> float32 (n_faces, 68, 2)
+    points = np.asarray(points if points is not None else [], dtype=np.float32)
+    return points.reshape(-1, 68, points.shape[-1] if points.ndim > 1 else 2)[..., :2]
+
+
+def detect_clip(job):
+    if(isinstance(fa, Exception)):
+        raise fa
+    (src, savename, batch_size) = job
+    (files, frames) = load_clip(src)
+    # frames cv2.imread cannot read (None) keep zero faces, as the per-frame detector gave them
+    points_list = [face_points(None)] * len(files)
+    for i in range(0, len(files), batch_size):
+        # one detector call per frame shape in the batch, so frames of other sizes do not break np.stack
+        groups = {}
+        for k in range(i, min(i + batch_size, len(files))):
+            if(frames[k] is not None):
+                groups.setdefault(frames[k].shape, []).append(k)
+        for ks in groups.values():
+            batch = torch.from_numpy(np.stack([frames[k] for k in ks])).permute(0, 3, 1, 2)
+            for (k, points) in zip(ks, fa.get_landmarks_from_batch(batch)):
+                points_list[k] = face_points(points)
+    landmarks.save(savename + '.tmp.npz', files, points_list)
+    os.replace(savename + '.tmp.npz', savename)
+    return len(files)
+
+
+def clips_from_list(names, src, dst):
+    # jpg frames grouped by directory; .npy entries are whole clips
+    clips = {}
+    for name in names:
+        if(name.endswith('.npy')):
+            clips[name] = None
+        else:
+            (dir, file) = os.path.split(name)
+            clips.setdefault(dir, []).append(file)
+    out = []
+    for (path, files) in clips.items():
+        if(files is not None):
+            files = sorted(files, key=lambda file: int(os.path.splitext(file)[0]))
+        dir = path[:-len('.npy')] if path.endswith('.npy') else path
+        out.append(((path, files), os.path.join(dir.replace(src, dst), landmarks.NAME)))
+    return out
+
 
 if(__name__ == '__main__'):
-    with open('imgs.txt', 'r') as f:
-        data = [line.strip() for line in f.readlines()]
-    
-    data = [(name, name.replace('.jpg', '.txt')) for name in data]
-    for (_, dst) in data:
-        dir, _ = os.path.split(dst)
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--list', default='imgs.txt', help='frame .jpg files and/or clip .npy arrays, one per line')
+    ap.add_argument('--src', default='GRID/6k_video_imgs')
+    ap.add_argument('--dst', default='GRID/landmarks')
+    ap.add_argument('--device', default='cuda', help='comma-separated, e.g. cuda:0,cuda:1 or cpu; workers cycle through them')
+    ap.add_argument('--workers', type=int, default=1)
+    ap.add_argument('--batch_size', type=int, default=32, help='frames per detector call')
+    ap.add_argument('--overwrite', action='store_true')
+    args = ap.parse_args()
+
+    with open(args.list, 'r') as f:
+        names = [line.strip() for line in f.readlines() if line.strip()]
+    jobs = []
+    for (src, savename) in clips_from_list(names, args.src, args.dst):
+        if(not args.overwrite and os.path.exists(savename)): continue
+        dir, _ = os.path.split(savename)
         if(not os.path.exists(dir)):
             os.makedirs(dir)
-       
-    processes = []
-    n_p = 3
-    gpus = ['1', '2', '3']
-    bs = len(data) // n_p
-    for i in range(n_p):
-        if(i == n_p - 1):
-            bs = len(data)
-        p = Process(target=run, args=(gpus[i],data[:bs],))
-        data = data[bs:]
-        p.start()
-        processes.append(p)
-    assert(len(data) == 0)
-    for p in processes:
-        p.join()
+        jobs.append((src, savename, args.batch_size))
+
+    devices = args.device.split(',')
+    print('n_clips={},workers={},devices={}'.format(len(jobs), args.workers, devices))
+    # spawn: CUDA cannot be re-initialized in forked children
+    ctx = mp.get_context('spawn')
+    counter = ctx.Value('i', 0)
+    tic = time.time()
+    n_frames = 0
+    with ctx.Pool(args.workers, initializer=init_worker, initargs=(devices, counter)) as pool:
+        for (count, n) in enumerate(pool.imap_unordered(detect_clip, jobs), 1):
+            n_frames += n
+            if(count % 100 == 0 or count == len(jobs)):
+                t = time.time() - tic
+                print('clips={}/{},frames/s={:.1f},eta={}'.format(count, len(jobs), n_frames / t, t / count * (len(jobs) - count) / 3600.0))
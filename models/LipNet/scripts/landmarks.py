@@ -0,0 +1,68 @@
+import os
+import re
+import time
+import argparse
+import numpy as np
+from multiprocessing import Pool
+
+# Per-clip binary landmark store, <landmark dir>/landmarks.npz:
+#   points - float32 (total_faces, 68, 2), the faces of every frame back to back
+#   counts - int32 (n_frames,), faces detected in each frame (0 if none)
+#   frames - frame file names, in the order of counts
+NAME = 'landmarks.npz'
+_NUM = re.compile(r'[-+0-9.eE]+')
+
+
+def save(path, frames, points_list):
+    # points_list: per frame, None or a sequence of (68, 2) faces
+    points_list = [[] if p is None else p for p in points_list]
+    counts = np.array([len(p) for p in points_list], dtype=np.int32)
+    faces = [np.asarray(f, dtype=np.float32).reshape(68, 2) for p in points_list for f in p]
+    points = np.stack(faces) if faces else np.zeros((0, 68, 2), np.float32)
+    np.savez(path, points=points, counts=counts, frames=np.array(frames))
+
+
+def load(path):
+    # -> (frame names, per-frame (n_faces, 68, 2) arrays)
+    z = np.load(path)
+    counts = z['counts']
+    faces = np.split(z['points'], np.cumsum(counts)[:-1]) if len(counts) else []
+    return [str(f) for f in z['frames']], faces
+
+
+def parse_txt(name):
+    # legacy face_det_sfd output: one face per line, 68 tab-separated "(x, y)"
+    with open(name, 'r') as f:
+        text = f.read()
+    faces = [np.array(_NUM.findall(line), dtype=np.float64).reshape(-1, 2) for line in text.splitlines() if line.strip()]
+    return faces
+
+
+def from_txt(anno_dir):
+    files = sorted([file for file in os.listdir(anno_dir) if file.endswith('.txt')],
+        key=lambda file: int(os.path.splitext(file)[0]) if os.path.splitext(file)[0].isdigit() else file)
+    frames = [file.replace('.txt', '.jpg') for file in files]
+    return frames, [parse_txt(os.path.join(anno_dir, file)) for file in files]
+
+
+def convert(anno_dir):
+    frames, faces = from_txt(anno_dir)
+    save(os.path.join(anno_dir, NAME), frames, faces)
+    return len(frames)
+
+
+if(__name__ == '__main__'):
+    # convert text landmark folders to landmarks.npz
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--list', required=True, help='landmark directories, one per line')
+    ap.add_argument('--workers', type=int, default=os.cpu_count())
+    args = ap.parse_args()
+    with open(args.list, 'r') as f:
+        dirs = [line.strip() for line in f if line.strip()]
+    tic = time.time()
+    frames = 0
+    with Pool(args.workers) as pool:
+        for (i, n) in enumerate(pool.imap_unordered(convert, dirs), 1):
+            frames += n
+            if(i % 1000 == 0 or i == len(dirs)):
+                print('{}/{} clips, {:.1f} frames/s'.format(i, len(dirs), frames / (time.time() - tic)))
@@ -0,0 +1,248 @@
+"""Throughput benchmark for the wer_eval toolchain on synthetic data (CPU only).
+
+Generates Vietnamese-like ref/hyp JSONL, n-best lists, peaky CTC logprob
+matrices and a small bigram ARPA LM under --work_dir, then runs each stage as
+its own process and records wall time, utt/s and peak RSS:
+
+  python -m wer_eval.bench --work_dir /tmp/wer_bench --n_utts 5000 --report bench.json
+
+Re-run with the same --work_dir/--seed to reuse the generated data.
+"""
+import argparse, json, math, os, platform, subprocess, sys, time, unicodedata
+from collections import Counter
+import numpy as np
+
+_ONSETS = ["", "b", "c", "ch", "d", "đ", "g", "gi", "h", "k", "kh", "l", "m", "n", "ng", "nh",
+           "ph", "qu", "r", "s", "t", "th", "tr", "v", "x"]
+_RHYMES = ["a", "ai", "an", "anh", "ao", "at", "ay", "e", "em", "en", "i", "in", "o", "oi", "on",
+           "ong", "u", "ui", "ung", "ư", "ưa", "ương", "ơ", "ơi", "ê", "ênh", "ô", "ông", "iêu", "yên"]
+# sắc, huyền, hỏi, ngã, nặng as combining marks (level tone has none)
+_TONES = ["", "\u0301", "\u0300", "\u0309", "\u0303", "\u0323"]
+_PUNCT = ["", "", "", ",", ".", "?", "!", "…"]
+
+def make_lexicon(rng, size):
+    words = set()
+    while len(words) < size:
+        rhyme = _RHYMES[rng.integers(len(_RHYMES))]
+        tone = _TONES[rng.integers(len(_TONES))]
+        # tone mark sits on the vowel carrying a hat/horn (ơ in ương), else on the first vowel
+        marked = [i for i, c in enumerate(rhyme) if c in "âăêôơư"]
+        k = (marked[-1] if marked else 0) + 1
+        syl = _ONSETS[rng.integers(len(_ONSETS))] + rhyme[:k] + tone + rhyme[k:]
+        words.add(unicodedata.normalize("NFC", syl))
+    return sorted(words)
+
+def make_sentence(rng, lexicon, zipf):
+    n = int(rng.integers(3, 16))
+    idx = np.minimum(rng.zipf(zipf, n) - 1, len(lexicon) - 1)
+    return [lexicon[i] for i in idx]
+
+def corrupt(rng, words, lexicon, rate):
+    out = []
+    for w in words:
+        r = rng.random()
+        if r < rate / 3:
+            continue
+        if r < 2 * rate / 3:
+            w = lexicon[rng.integers(len(lexicon))]
+        out.append(w)
+        if rng.random() < rate / 3:
+            out.append(lexicon[rng.integers(len(lexicon))])
+    return out
+
+def surface(rng, words):
+    # raw text as a model or annotator would emit it: mixed case, punctuation, NFD, extra spaces
+    s = " ".join(w.capitalize() if rng.random() < 0.1 else w for w in words)
+    s += _PUNCT[rng.integers(len(_PUNCT))]
+    if rng.random() < 0.2:
+        s = unicodedata.normalize("NFD", s)
+    if rng.random() < 0.1:
+        s = "  " + s.replace(" ", "   ", 1)
+    return s
+
+def write_arpa(path, sentences, discount=0.5):
+    """Bigram ARPA with absolute discounting and backoff to add-one unigrams."""
+    uni, bi = Counter(), Counter()
+    for ws in sentences:
+        toks = ["<s>"] + ws + ["</s>"]
+        uni.update(toks[1:])
+        bi.update(zip(toks[:-1], toks[1:]))
+    vocab = sorted(uni) + ["<unk>"]
+    total = sum(uni.values())
+    p_uni = {w: (uni[w] + 1) / (total + len(vocab)) for w in vocab}
+    hist = Counter()
+    succ = {}
+    for (a, b), c in bi.items():
+        hist[a] += c
+        succ.setdefault(a, []).append(b)
+    p_bi, bow = {}, {}
+    for (a, b), c in bi.items():
+        p_bi[(a, b)] = (c - discount) / hist[a]
+    for a, bs in succ.items():
+        left = discount * len(bs) / hist[a]
+        bow[a] = left / max(1.0 - sum(p_uni.get(b, 0.0) for b in bs), 1e-9)
+    lg = lambda x: math.log10(max(x, 1e-99))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"\\data\\\nngram 1={len(vocab) + 1}\nngram 2={len(p_bi)}\n\n\\1-grams:\n")
+        f.write(f"-99\t<s>\t{lg(bow.get('<s>', 1.0)):.6f}\n")
+        for w in vocab:
+            f.write(f"{lg(p_uni[w]):.6f}\t{w}\t{lg(bow.get(w, 1.0)):.6f}\n")
+        f.write("\n\\2-grams:\n")
+        for (a, b), p in sorted(p_bi.items()):
+            f.write(f"{lg(p):.6f}\t{a} {b}\n")
+        f.write("\n\\end\\\n")
+
+def ctc_logprobs(rng, text, char_ids, vocab_size, sharpness=8.0):
+    # 25 fps-like alignment: every char preceded by a run of blanks, repeats split by a blank
+    path = []
+    for ch in text:
+        path += [0] * int(rng.integers(1, 5)) + [char_ids[ch]] * int(rng.integers(1, 3))
+    path += [0] * int(rng.integers(2, 8))
+    logits = rng.normal(0.0, 1.0, (len(path), vocab_size)).astype(np.float32)
+    logits[np.arange(len(path)), path] += sharpness
+    logits -= logits.max(axis=1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=1, keepdims=True))
+
+def generate(work_dir, n_utts, n_ctc, nbest, lexicon_size, wer_rate, seed):
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(work_dir, "logprobs"), exist_ok=True)
+    lexicon = make_lexicon(rng, lexicon_size)
+    sents = [make_sentence(rng, lexicon, 1.3) for _ in range(n_utts)]
+    write_arpa(os.path.join(work_dir, "lm.arpa"), [make_sentence(rng, lexicon, 1.3) for _ in range(n_utts)] + sents)
+
+    with open(os.path.join(work_dir, "hyp.jsonl"), "w", encoding="utf-8") as f:
+        for i, ws in enumerate(sents):
+            it = {"utt_id": f"utt{i:07d}", "ref": surface(rng, ws), "hyp": surface(rng, corrupt(rng, ws, lexicon, wer_rate))}
+            f.write(json.dumps(it, ensure_ascii=False) + "\n")
+
+    with open(os.path.join(work_dir, "nbest.jsonl"), "w", encoding="utf-8") as f:
+        for i, ws in enumerate(sents):
+            cands = []
+            for k in range(nbest):
+                c = corrupt(rng, ws, lexicon, wer_rate * (0.5 + k / max(nbest, 1)))
+                cands.append({"text": surface(rng, c), "am_score": float(-2.0 * k - rng.exponential(3.0))})
+            f.write(json.dumps({"utt_id": f"utt{i:07d}", "ref": " ".join(ws), "cands": cands}, ensure_ascii=False) + "\n")
+
+    chars = sorted({c for ws in sents[:n_ctc] for w in ws for c in w})
+    labels = ["", " "] + chars
+    with open(os.path.join(work_dir, "vocab.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(labels) + "\n")
+    char_ids = {c: i for i, c in enumerate(labels)}
+    with open(os.path.join(work_dir, "ctc.jsonl"), "w", encoding="utf-8") as f:
+        for i, ws in enumerate(sents[:n_ctc]):
+            p = os.path.join(work_dir, "logprobs", f"utt{i:07d}.npy")
+            np.save(p, ctc_logprobs(rng, " ".join(ws), char_ids, len(labels)))
+            it = {"utt_id": f"utt{i:07d}", "ref": " ".join(ws), "logprobs_path": p,
+                  "vocab_path": os.path.join(work_dir, "vocab.txt")}
+            f.write(json.dumps(it, ensure_ascii=False) + "\n")
+
+def _normalize_stage(path, repeats):
+    from .normalize import normalize_text
+    texts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            it = json.loads(line)
+            texts += [it["ref"], it["hyp"]]
+    for _ in range(repeats):
+        for t in texts:
+            normalize_text(t)
+
+def run_stage(name, module_args, n, cwd):
+    """Run `python -m <module_args>` and return wall time, utt/s and the child's peak RSS."""
+    t0 = time.perf_counter()
+    with subprocess.Popen([sys.executable, "-m"] + module_args, cwd=cwd,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as p:
+        out = p.stdout.read().decode("utf-8", "replace")
+        # reaped with wait4 for this child's own rusage: RUSAGE_CHILDREN's ru_maxrss is the peak over all
+        # children so far, not a per-stage delta. The status is stored on the Popen, so its wait() (also
+        # run on leaving the with block) returns it instead of reaping the pid a second time
+        _, status, ru = os.wait4(p.pid, 0)
+        p.returncode = os.waitstatus_to_exitcode(status)
+    dt = time.perf_counter() - t0
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    rss_mb = ru.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+    row = {"stage": name, "n": n, "seconds": round(dt, 3), "utt_per_s": round(n / dt, 2) if dt > 0 else None,
+           "peak_rss_mb": round(rss_mb, 1), "returncode": p.returncode}
+    if p.returncode != 0:
+        row["output_tail"] = out[-2000:]
+    return row
+
+STAGES = ["normalize", "compute_wer", "compute_wer_bootstrap", "rescore_nbest", "tune_nbest",
+          "pack_logprobs", "decode_ctc", "decode_ctc_packed", "tune_ctc"]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--work_dir", required=True)
+    ap.add_argument("--report", default="", help="JSON report path (default: <work_dir>/bench_report.json)")
+    ap.add_argument("--n_utts", type=int, default=5000, help="utterances for the text/n-best stages")
+    ap.add_argument("--n_ctc", type=int, default=300, help="utterances for the CTC decode stages")
+    ap.add_argument("--nbest", type=int, default=10)
+    ap.add_argument("--lexicon", type=int, default=3000)
+    ap.add_argument("--wer_rate", type=float, default=0.25)
+    ap.add_argument("--workers", type=int, default=max(1, min(4, os.cpu_count() or 1)))
+    ap.add_argument("--stages", default=",".join(STAGES))
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--regen", action="store_true", help="regenerate data even if --work_dir has it")
+    ap.add_argument("--_normalize", default="", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args._normalize:
+        _normalize_stage(args._normalize, 5)
+        return
+
+    w = os.path.abspath(args.work_dir)
+    stamp = os.path.join(w, "config.json")
+    cfg = {k: getattr(args, k) for k in ("n_utts", "n_ctc", "nbest", "lexicon", "wer_rate", "seed")}
+    if args.regen or not os.path.exists(stamp) or json.load(open(stamp, "r", encoding="utf-8")) != cfg:
+        t0 = time.perf_counter()
+        generate(w, args.n_utts, args.n_ctc, args.nbest, args.lexicon, args.wer_rate, args.seed)
+        with open(stamp, "w", encoding="utf-8") as f:
+            json.dump(cfg, f)
+        print(f"Generated data in {time.perf_counter() - t0:.1f}s under {w}")
+
+    pkg = __package__ or "wer_eval"
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    j = lambda *p: os.path.join(w, *p)
+    lm = j("lm.arpa")
+    W = str(args.workers)
+    grid = ["--alpha_grid", "0.3,0.6", "--beta_grid", "0.0,1.0"]
+    plan = {
+        "normalize": (["bench", "--work_dir", w, "--_normalize", j("hyp.jsonl")], 2 * 5 * args.n_utts),
+        "compute_wer": (["compute_wer_jsonl", "--jsonl", j("hyp.jsonl"), "--workers", W], args.n_utts),
+        "compute_wer_bootstrap": (["compute_wer_jsonl", "--jsonl", j("hyp.jsonl"), "--bootstrap", "10000"], args.n_utts),
+        "rescore_nbest": (["rescore_nbest_kenlm", "--nbest_jsonl", j("nbest.jsonl"), "--lm_bin", lm,
+                           "--alpha", "0.5", "--beta", "0.5", "--out_jsonl", j("rescored.jsonl"), "--workers", W], args.n_utts),
+        "tune_nbest": (["tune_alpha_beta", "--mode", "nbest", "--in_jsonl", j("nbest.jsonl"), "--lm_bin", lm], args.n_utts),
+        "pack_logprobs": (["logprob_store", "--ctc_jsonl", j("ctc.jsonl"), "--out_dir", j("ctc.pack")], args.n_ctc),
+        "decode_ctc": (["decode_ctc_kenlm", "--ctc_jsonl", j("ctc.jsonl"), "--lm_bin", lm, "--alpha", "0.5",
+                        "--beta", "1.0", "--out_jsonl", j("decoded.jsonl"), "--workers", W], args.n_ctc),
+        "decode_ctc_packed": (["decode_ctc_kenlm", "--ctc_jsonl", j("ctc.pack"), "--lm_bin", lm, "--alpha", "0.5",
+                               "--beta", "1.0", "--out_jsonl", j("decoded_packed.jsonl"), "--workers", W], args.n_ctc),
+        # n counts decoded utterances over the whole 2x2 grid
+        "tune_ctc": (["tune_alpha_beta", "--mode", "ctc", "--in_jsonl", j("ctc.jsonl"), "--lm_bin", lm,
+                      "--workers", W] + grid, 4 * args.n_ctc),
+    }
+    rows = []
+    for name in args.stages.split(","):
+        mod, n = plan[name]
+        row = run_stage(name, [f"{pkg}.{mod[0]}"] + mod[1:], n, cwd)
+        rows.append(row)
+        print(f"{name:<24}{row['seconds']:>9.2f}s{row['utt_per_s'] or 0:>12.1f} utt/s"
+              f"{row['peak_rss_mb']:>10.1f} MB" + ("" if row["returncode"] == 0 else "  FAILED"))
+
+    report = {
+        "config": {**cfg, "workers": args.workers},
+        "host": {"python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "numpy": np.__version__},
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stages": rows,
+    }
+    path = args.report or j("bench_report.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"Report: {path}")
+    if any(r["returncode"] != 0 for r in rows):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+from collections import deque
+
+def bounded_imap(pool, fn, iterable, max_pending):
+    """Ordered pool.imap that keeps at most max_pending tasks in flight.
+
+    Pool.imap drains its input eagerly, so a million-line file would be read into
+    the task queue up front; this keeps memory flat regardless of input size.
+    """
+    pending = deque()
+    for x in iterable:
+        pending.append(pool.apply_async(fn, (x,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
@@ -0,0 +1,49 @@
+"""Property test: normalize_text matches the original regex normalizer.
+
+Run from the model directory with: python -m pytest wer_eval/test_normalize.py
+"""
+import random
+import re
+import unicodedata
+
+import pytest
+
+from wer_eval.normalize import _PUNCT, normalize_text, normalize_batch
+
+def _normalize_regex(s):
+    # reference implementation; normalize_text must match it exactly
+    if s is None:
+        return ""
+    s = str(s)
+    s = unicodedata.normalize("NFC", s)
+    s = s.lower()
+    s = re.sub(_PUNCT, "", s)
+    s = re.sub(r"\s+", " ", s).strip()
+    return s
+
+def _random_text(rng):
+    alphabet = ("abcdxyzABCDXYZ0123 ăâđêôơưĂÂĐÊÔƠƯáàảãạấầẩẫậếềểễệốồổỗộớờởỡợứừửữựÁÀẢÃẠẾỀỂỄỆ"
+                ".,;:!?…\"'-()"
+                # combining tone/hat/horn marks, then assorted Unicode whitespace
+                "\u0300\u0301\u0303\u0309\u0323\u0302\u0306\u031b"
+                "\t\n\r\x0b\x0c\x1c\x1f\x85\xa0\u1680\u2002\u2009\u2028\u2029\u202f\u3000\u200b"
+                # case mappings that are context-sensitive or change length
+                "\u03a3\u03c3\u03c2\u0391\u0130I\u1e9e\xdf")
+    n = rng.randrange(0, 40)
+    chars = [rng.choice(alphabet) if rng.random() < 0.9 else chr(rng.randrange(0x20, 0x3000)) for _ in range(n)]
+    s = "".join(chars)
+    return unicodedata.normalize("NFD", s) if rng.random() < 0.3 else s
+
+@pytest.mark.parametrize("s", [None, "", 0, 1.5, "  Xin chào, Thế Giới!  ", "a\xa0b\u3000c\u200bd"])
+def test_edge_cases(s):
+    assert normalize_text(s) == _normalize_regex(s)
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_regex_reference(seed):
+    rng = random.Random(seed)
+    bad = [s for s in (_random_text(rng) for _ in range(25000)) if normalize_text(s) != _normalize_regex(s)]
+    assert bad == [], f"{len(bad)} mismatches, e.g. {bad[0]!r}"
+
+def test_normalize_batch():
+    texts = ["Một, hai!", None, "Một, hai!", "BA"]
+    assert normalize_batch(texts) == [_normalize_regex(t) for t in texts]
@@ -0,0 +1,39 @@
+import numpy as np
+
+def _resampled_sums(rng, cols, n_boot, max_cells=1 << 24):
+    # utterance-level resampling with replacement, B x n index matrix built in bounded chunks
+    n = len(cols[0])
+    step = max(1, max_cells // max(n, 1))
+    for i in range(0, n_boot, step):
+        idx = rng.integers(0, n, size=(min(step, n_boot - i), n))
+        yield [c[idx].sum(axis=1) for c in cols]
+
+def bootstrap_wer(errs, ref_words, n_boot=10000, seed=0):
+    """Corpus WER of each of n_boot resamples of the utterances."""
+    rng = np.random.default_rng(seed)
+    errs = np.asarray(errs, dtype=np.int64)
+    ref_words = np.asarray(ref_words, dtype=np.int64)
+    return np.concatenate([e / np.maximum(r, 1)
+                           for e, r in _resampled_sums(rng, (errs, ref_words), n_boot)])
+
+def bootstrap_ci(errs, ref_words, n_boot=10000, ci=0.95, seed=0):
+    wers = bootstrap_wer(errs, ref_words, n_boot, seed)
+    lo, hi = np.quantile(wers, [(1 - ci) / 2, 1 - (1 - ci) / 2])
+    return float(lo), float(hi)
+
+def paired_bootstrap(errs_a, errs_b, ref_words, n_boot=10000, ci=0.95, seed=0):
+    """Paired bootstrap of WER(A) - WER(B) over utterances shared by both systems.
+
+    Both systems are resampled with the same indices. Returns (observed delta,
+    ci_lo, ci_hi, two-sided p-value for delta == 0).
+    """
+    rng = np.random.default_rng(seed)
+    ea = np.asarray(errs_a, dtype=np.int64)
+    eb = np.asarray(errs_b, dtype=np.int64)
+    r = np.asarray(ref_words, dtype=np.int64)
+    deltas = np.concatenate([(a - b) / np.maximum(n, 1)
+                             for a, b, n in _resampled_sums(rng, (ea, eb, r), n_boot)])
+    obs = (ea.sum() - eb.sum()) / max(r.sum(), 1)
+    lo, hi = np.quantile(deltas, [(1 - ci) / 2, 1 - (1 - ci) / 2])
+    p = min(1.0, 2 * min((deltas <= 0).mean(), (deltas >= 0).mean()))
+    return float(obs), float(lo), float(hi), float(p)
@@ -1,6 +1,72 @@
 import argparse, json
+from functools import lru_cache
+from itertools import islice
+from multiprocessing import Pool
 import kenlm
 from .normalize import normalize_text
+from .parallel import bounded_imap
+
+# per-process LM scorer, set up once by _init_worker
+_lm_score = None
+
+def _init_worker(lm_bin, cache_size=1 << 18):
+    global _lm_score
+    try:
+        # binary models are mmapped, so every worker shares one copy in the page cache
+        lm = kenlm.Model(lm_bin)
+    except Exception as e:
+        # a raising initializer makes Pool respawn workers forever; fail on first task instead
+        _lm_score = e
+        return
+
+    @lru_cache(maxsize=cache_size)
+    def lm_score(txt: str) -> float:
+        # kenlm.Model.score returns log10
+        return float(lm.score(txt, bos=True, eos=True))
+    _lm_score = lm_score
+
+def rescore(it, alpha, beta):
+    cands = it.get("cands") or []
+    best_hyp = ""
+    best_s = -1e18
+    for c in cands:
+        txt = normalize_text(c.get("text",""))
+        am = float(c.get("am_score", 0.0))
+        s = am + alpha * _lm_score(txt) + beta * (len(txt.split()) if txt else 0)
+        if s > best_s:
+            best_s = s
+            best_hyp = txt
+    return {
+        "utt_id": it.get("utt_id"),
+        "ref": it.get("ref",""),
+        "hyp": best_hyp,
+        "alpha": alpha,
+        "beta": beta
+    }
+
+def _rescore_chunk(job):
+    if isinstance(_lm_score, Exception):
+        raise _lm_score
+    lines, alpha, beta = job
+    return "".join(json.dumps(rescore(json.loads(l), alpha, beta), ensure_ascii=False) + "\n" for l in lines)
+
+def _chunks(f, chunk_lines, alpha, beta):
+    while True:
+        lines = list(islice(f, chunk_lines))
+        if not lines:
+            return
+        yield lines, alpha, beta
+
+def iter_rescored(path, lm_bin, alpha, beta, workers=1, chunk_lines=200):
+    """Yield output JSONL text for each chunk of the n-best file, in file order."""
+    with open(path, "r", encoding="utf-8") as f:
+        jobs = _chunks(f, chunk_lines, alpha, beta)
+        if workers <= 1:
+            _init_worker(lm_bin)
+            yield from map(_rescore_chunk, jobs)
+            return
+        with Pool(workers, initializer=_init_worker, initargs=(lm_bin,)) as pool:
+            yield from bounded_imap(pool, _rescore_chunk, jobs, 2 * workers)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -9,35 +75,14 @@ def main():
     ap.add_argument("--alpha", type=float, required=True)
     ap.add_argument("--beta", type=float, required=True)
     ap.add_argument("--out_jsonl", required=True)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--chunk_lines", type=int, default=200, help="n-best lines rescored per task")
     args = ap.parse_args()
 
-    lm = kenlm.Model(args.lm_bin)
-
-    def lm_score(txt: str) -> float:
-        # kenlm.Model.score returns log10
-        return float(lm.score(txt, bos=True, eos=True))
-
-    with open(args.nbest_jsonl, "r", encoding="utf-8") as fin, open(args.out_jsonl, "w", encoding="utf-8") as fout:
-        for line in fin:
-            it = json.loads(line)
-            cands = it.get("cands") or []
-            best_hyp = ""
-            best_s = -1e18
-            for c in cands:
-                txt = normalize_text(c.get("text",""))
-                am = float(c.get("am_score", 0.0))
-                s = am + args.alpha * lm_score(txt) + args.beta * (len(txt.split()) if txt else 0)
-                if s > best_s:
-                    best_s = s
-                    best_hyp = txt
-            out = {
-                "utt_id": it.get("utt_id"),
-                "ref": it.get("ref",""),
-                "hyp": best_hyp,
-                "alpha": args.alpha,
-                "beta": args.beta
-            }
-            fout.write(json.dumps(out, ensure_ascii=False) + "\n")
+    with open(args.out_jsonl, "w", encoding="utf-8") as fout:
+        for text in iter_rescored(args.nbest_jsonl, args.lm_bin, args.alpha, args.beta,
+                                  args.workers, args.chunk_lines):
+            fout.write(text)
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,83 @@
-import argparse, json
-from jiwer import wer
+import argparse, json, os
+from array import array
+from collections import Counter
+from itertools import islice
+from multiprocessing import Pool
+import numpy as np
 from .normalize import normalize_text
+from .edit_distance import edit_ops
+from .bootstrap import bootstrap_ci, paired_bootstrap
+from .parallel import bounded_imap
+
+def score_pair(ref: str, hyp: str):
+    """Word- and char-level edit counts for one normalized ref/hyp pair."""
+    rw, hw = ref.split(), hyp.split()
+    ws, wi, wd, pairs = edit_ops(rw, hw)
+    cs, ci, cd, _ = edit_ops(ref, hyp)
+    return {
+        "ref_words": len(rw), "w_sub": ws, "w_ins": wi, "w_del": wd,
+        "ref_chars": len(ref), "c_sub": cs, "c_ins": ci, "c_del": cd,
+        "subs": pairs,
+    }
+
+def _score_chunk(job):
+    lines, ref_key, hyp_key = job
+    recs = []
+    for line in lines:
+        it = json.loads(line)
+        if ref_key not in it or hyp_key not in it:
+            continue
+        ref = normalize_text(it[ref_key])
+        hyp = normalize_text(it[hyp_key])
+        if ref == "" and hyp == "":
+            continue
+        recs.append({"utt_id": it.get("utt_id"), "ref": ref, "hyp": hyp, **score_pair(ref, hyp)})
+    return recs
+
+def _chunks(f, chunk_lines, ref_key, hyp_key):
+    while True:
+        lines = list(islice(f, chunk_lines))
+        if not lines:
+            return
+        yield lines, ref_key, hyp_key
+
+def iter_scored(path, ref_key="ref", hyp_key="hyp", workers=1, chunk_lines=2000):
+    """Yield the per-utterance records of each chunk of the JSONL, in file order."""
+    with open(path, "r", encoding="utf-8") as f:
+        jobs = _chunks(f, chunk_lines, ref_key, hyp_key)
+        if workers <= 1:
+            yield from map(_score_chunk, jobs)
+            return
+        with Pool(workers) as pool:
+            yield from bounded_imap(pool, _score_chunk, jobs, 2 * workers)
+
+def _cache_path(path):
+    return path + ".errs.npz"
+
+def save_error_arrays(path, ref_key, hyp_key, ids, errs, ref_words):
+    np.savez(_cache_path(path), keys=f"{ref_key}\t{hyp_key}", utt_ids=np.asarray([str(u) for u in ids]),
+             errs=np.asarray(errs, dtype=np.int64), ref_words=np.asarray(ref_words, dtype=np.int64))
+
+def error_arrays(path, ref_key="ref", hyp_key="hyp", workers=1, chunk_lines=2000, cache=False):
+    """(utt_ids, word errors, ref words) per scored utterance.
+
+    With cache=True the arrays are kept in <path>.errs.npz and reused while it is
+    newer than the JSONL, so repeated comparisons against one baseline score it once.
+    """
+    cpath = _cache_path(path)
+    if cache and os.path.exists(cpath) and os.path.getmtime(cpath) >= os.path.getmtime(path):
+        z = np.load(cpath)
+        if str(z["keys"]) == f"{ref_key}\t{hyp_key}":
+            return z["utt_ids"], z["errs"], z["ref_words"]
+    ids, errs, refw = [], array("i"), array("i")
+    for recs in iter_scored(path, ref_key, hyp_key, workers, chunk_lines):
+        for r in recs:
+            ids.append(r["utt_id"])
+            errs.append(r["w_sub"] + r["w_ins"] + r["w_del"])
+            refw.append(r["ref_words"])
+    if cache:
+        save_error_arrays(path, ref_key, hyp_key, ids, errs, refw)
+    return np.asarray([str(u) for u in ids]), np.asarray(errs, dtype=np.int64), np.asarray(refw, dtype=np.int64)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -8,29 +85,93 @@ def main():
     ap.add_argument("--ref_key", default="ref")
     ap.add_argument("--hyp_key", default="hyp")
     ap.add_argument("--limit", type=int, default=0)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--chunk_lines", type=int, default=2000, help="JSONL lines scored per task")
+    ap.add_argument("--per_utt_jsonl", default="", help="write per-utterance edit counts here")
+    ap.add_argument("--top_confusions", type=int, default=10, help="print the most frequent word substitutions")
+    ap.add_argument("--report_json", default="", help="write corpus totals and top confusions here")
+    ap.add_argument("--bootstrap", type=int, default=0, help="utterance-level bootstrap resamples for a WER CI (e.g. 10000)")
+    ap.add_argument("--ci", type=float, default=0.95)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--compare_jsonl", default="", help="paired bootstrap test against this system, matched on utt_id (10000 resamples unless --bootstrap)")
+    ap.add_argument("--cache", action="store_true", help="keep per-utterance (errors, ref_words) in <jsonl>.errs.npz")
     args = ap.parse_args()
 
-    refs, hyps = [], []
+    keys = ("ref_words", "w_sub", "w_ins", "w_del", "ref_chars", "c_sub", "c_ins", "c_del")
+    tot = dict.fromkeys(keys, 0)
+    conf = Counter()
     n = 0
-    with open(args.jsonl, "r", encoding="utf-8") as f:
-        for line in f:
-            it = json.loads(line)
-            if args.ref_key not in it or args.hyp_key not in it:
-                continue
-            ref = normalize_text(it[args.ref_key])
-            hyp = normalize_text(it[args.hyp_key])
-            if ref == "" and hyp == "":
-                continue
-            refs.append(ref)
-            hyps.append(hyp)
-            n += 1
+    # per-utterance arrays only when a CI, a comparison or the cache needs them; ids only for the latter two
+    keep_ids = bool(args.compare_jsonl) or (args.cache and not args.limit)
+    keep_errs = keep_ids or args.bootstrap > 0
+    ids, errs, refw = [], array("i"), array("i")
+    fout = open(args.per_utt_jsonl, "w", encoding="utf-8") if args.per_utt_jsonl else None
+    try:
+        for recs in iter_scored(args.jsonl, args.ref_key, args.hyp_key, args.workers, args.chunk_lines):
+            if args.limit:
+                recs = recs[:args.limit - n]
+            for r in recs:
+                for k in keys:
+                    tot[k] += r[k]
+                conf.update(tuple(p) for p in r["subs"])
+                if keep_ids:
+                    ids.append(str(r["utt_id"]))
+                if keep_errs:
+                    errs.append(r["w_sub"] + r["w_ins"] + r["w_del"])
+                    refw.append(r["ref_words"])
+                if fout is not None:
+                    fout.write(json.dumps(r, ensure_ascii=False) + "\n")
+            n += len(recs)
             if args.limit and n >= args.limit:
                 break
-    if not refs:
+    finally:
+        if fout is not None:
+            fout.close()
+    if n == 0:
         raise SystemExit("No valid ref/hyp pairs found.")
-    w = wer(refs, hyps)
-    print(f"Samples: {len(refs)}")
-    print(f"WER: {w*100:.2f}%")
+
+    w_err = tot["w_sub"] + tot["w_ins"] + tot["w_del"]
+    c_err = tot["c_sub"] + tot["c_ins"] + tot["c_del"]
+    w = w_err / max(tot["ref_words"], 1)
+    c = c_err / max(tot["ref_chars"], 1)
+    print(f"Samples: {n}")
+    print(f"WER: {w*100:.2f}%  (S={tot['w_sub']} I={tot['w_ins']} D={tot['w_del']} / N={tot['ref_words']})")
+    print(f"CER: {c*100:.2f}%  (S={tot['c_sub']} I={tot['c_ins']} D={tot['c_del']} / N={tot['ref_chars']})")
+    top = conf.most_common(args.top_confusions)
+    if top:
+        print("Top substitutions (ref -> hyp):")
+        for (r, h), k in top:
+            print(f"  {r} -> {h}: {k}")
+    if args.cache and not args.limit:
+        save_error_arrays(args.jsonl, args.ref_key, args.hyp_key, ids, errs, refw)
+
+    report = {"samples": n, "wer": w, "cer": c, **tot}
+    n_boot = args.bootstrap or (10000 if args.compare_jsonl else 0)
+    if args.bootstrap:
+        lo, hi = bootstrap_ci(errs, refw, n_boot, args.ci, args.seed)
+        print(f"WER {args.ci*100:g}% CI: [{lo*100:.2f}%, {hi*100:.2f}%] ({n_boot} resamples)")
+        report.update(wer_ci=[lo, hi], ci=args.ci, bootstrap=n_boot)
+    if args.compare_jsonl:
+        ids_b, errs_b, _ = error_arrays(args.compare_jsonl, args.ref_key, args.hyp_key,
+                                        args.workers, args.chunk_lines, args.cache)
+        pos = {u: i for i, u in enumerate(ids_b)}
+        ia = [i for i, u in enumerate(ids) if u in pos]
+        ib = [pos[ids[i]] for i in ia]
+        if not ia:
+            raise SystemExit(f"No shared utt_ids between {args.jsonl} and {args.compare_jsonl}.")
+        if len(ia) < max(n, len(ids_b)):
+            print(f"Paired on {len(ia)} shared utt_ids ({n} vs {len(ids_b)} scored)")
+        ea = np.asarray(errs, dtype=np.int64)[ia]
+        r = np.asarray(refw, dtype=np.int64)[ia]
+        d, lo, hi, p = paired_bootstrap(ea, errs_b[ib], r, n_boot, args.ci, args.seed)
+        print(f"Paired bootstrap vs {args.compare_jsonl}: WER(A)-WER(B) = {d*100:+.2f}% "
+              f"[{lo*100:+.2f}%, {hi*100:+.2f}%], p = {p:.4f} ({n_boot} resamples, {len(ia)} utts)")
+        report.update(compare_jsonl=args.compare_jsonl, paired_utts=len(ia), delta_wer=d,
+                      delta_ci=[lo, hi], p_value=p)
+    if args.report_json:
+        report["top_confusions"] = [{"ref": r, "hyp": h, "count": k} for (r, h), k in top]
+        with open(args.report_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
 
 if __name__ == "__main__":
     main()
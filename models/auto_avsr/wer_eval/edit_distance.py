@@ -0,0 +1,19 @@
+from rapidfuzz.distance import Levenshtein
+
+def word_errors(ref_words, hyp_words) -> int:
+    # S+D+I between two token lists; corpus WER = sum(errors) / sum(len(ref_words))
+    return Levenshtein.distance(ref_words, hyp_words)
+
+def edit_ops(ref, hyp):
+    """(sub, ins, del, substituted (ref, hyp) pairs) for token lists or strings."""
+    s = i = d = 0
+    pairs = []
+    for op in Levenshtein.editops(ref, hyp):
+        if op.tag == "replace":
+            s += 1
+            pairs.append((ref[op.src_pos], hyp[op.dest_pos]))
+        elif op.tag == "insert":
+            i += 1
+        else:
+            d += 1
+    return s, i, d, pairs
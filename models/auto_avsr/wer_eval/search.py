@@ -0,0 +1,167 @@
+import itertools, json, math, os
+import numpy as np
+
+FULL = "full"
+
+def _point(a, b):
+    # round so that logged points compare equal when a search is replayed from its log
+    return (round(float(a), 4), round(float(b), 4))
+
+class EvalLog:
+    """Evaluates (alpha, beta) points and remembers every result.
+
+    evaluate(points, utts) -> [(wer, seconds), ...] is one of the evaluators in
+    tune_alpha_beta. When `path` is given each result is appended there as a JSON
+    line as soon as it is known, and points already present are read back instead
+    of being decoded again, so an interrupted search resumes where it stopped.
+    """
+
+    def __init__(self, evaluate, path=""):
+        self.evaluate = evaluate
+        self.seen = {}
+        self.rows = []
+        self._used = set()
+        self.f = None
+        if path:
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            r = json.loads(line)
+                            self.seen[(r["stage"], r["n_utts"]) + _point(r["alpha"], r["beta"])] = r
+            self.f = open(path, "a", encoding="utf-8")
+
+    def run(self, stage, points, utts=None):
+        """WER of each point on `utts` (all utterances if None), in the order given."""
+        n = self.evaluate.n_utts if utts is None else len(utts)
+        points = [_point(a, b) for a, b in points]
+        todo = list(dict.fromkeys(p for p in points if (stage, n) + p not in self.seen))
+        if todo:
+            for (a, b), (w, dt) in zip(todo, self.evaluate(todo, utts)):
+                r = {"stage": stage, "n_utts": n, "alpha": a, "beta": b, "wer": float(w), "seconds": round(dt, 3)}
+                self.seen[(stage, n, a, b)] = r
+                print(f"[{stage}] alpha={a} beta={b} WER={w*100:.2f}% ({dt:.1f}s)")
+                if self.f is not None:
+                    self.f.write(json.dumps(r) + "\n")
+                    self.f.flush()
+        out = []
+        for p in points:
+            k = (stage, n) + p
+            if k not in self._used:
+                self._used.add(k)
+                self.rows.append(self.seen[k])
+            out.append(self.seen[k]["wer"])
+        return out
+
+    @property
+    def n_full(self):
+        return sum(r["stage"] == FULL for r in self.rows)
+
+    def best(self):
+        full = [r for r in self.rows if r["stage"] == FULL] or self.rows
+        return min(full, key=lambda r: r["wer"])
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+def _spacing(xs, default=0.1):
+    d = np.diff(np.unique(xs))
+    return float(d.min()) if len(d) else default
+
+def grid_search(log, alphas, betas):
+    return log.run(FULL, itertools.product(alphas, betas))
+
+def _coarse(log, alphas, betas, sub, seed):
+    # the coarse pass depends on the subsample, so its log entries are keyed by seed
+    grid = list(itertools.product(alphas, betas))
+    ws = log.run(f"coarse-seed{seed}", grid, sub)
+    order = np.argsort(ws, kind="stable")
+    return [grid[i] for i in order]
+
+def coarse_to_fine_search(log, alphas, betas, sub, max_evals=20, patience=2, tol=1e-4, batch=1, seed=0):
+    """Coarse grid on the subsample, then a pattern search around its best point on the full set.
+
+    Each round evaluates the neighbours of the current best point at the current
+    step; the step is halved whenever a round brings no gain larger than tol, and
+    the search stops after `patience` such rounds or `max_evals` full-set points.
+    """
+    a, b = _coarse(log, alphas, betas, sub, seed)[0]
+    da, db = _spacing(alphas), _spacing(betas)
+    best_w = log.run(FULL, [(a, b)])[0]
+    n_evals, stale = 1, 0
+    while n_evals < max_evals and stale < patience:
+        steps = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+        if batch >= 8:
+            steps += [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+        pts = [_point(a + i*da, b + j*db) for i, j in steps]
+        pts = [p for p in pts if p[0] >= 0][:max_evals - n_evals]
+        ws = log.run(FULL, pts)
+        n_evals += len(pts)
+        i = int(np.argmin(ws))
+        if ws[i] < best_w - tol:
+            best_w, (a, b), stale = ws[i], pts[i], 0
+        else:
+            da, db, stale = da / 2, db / 2, stale + 1
+    return (a, b), best_w
+
+def _gp_posterior(X, y, Xs, ls, jitter=1e-4):
+    # zero-mean GP with an RBF kernel on standardized targets
+    mu0, sd0 = y.mean(), y.std() or 1.0
+    yn = (y - mu0) / sd0
+    def k(A, B):
+        d = (A[:, None, :] - B[None, :, :]) / ls
+        return np.exp(-0.5 * (d ** 2).sum(-1))
+    L = np.linalg.cholesky(k(X, X) + jitter * np.eye(len(X)))
+    w = np.linalg.solve(L.T, np.linalg.solve(L, yn))
+    Ks = k(X, Xs)
+    v = np.linalg.solve(L, Ks)
+    var = np.clip(1.0 - (v ** 2).sum(0), 1e-12, None)
+    return Ks.T @ w * sd0 + mu0, np.sqrt(var) * sd0
+
+def _expected_improvement(mu, sd, best, xi=1e-4):
+    # minimization: expected amount by which a point beats the current best WER
+    z = (best - mu - xi) / sd
+    cdf = 0.5 * (1.0 + np.vectorize(math.erf)(z / math.sqrt(2.0)))
+    pdf = np.exp(-0.5 * z ** 2) / math.sqrt(2.0 * math.pi)
+    return (best - mu - xi) * cdf + sd * pdf
+
+def bayes_search(log, alphas, betas, sub, max_evals=20, patience=2, tol=1e-4, batch=1, seed=0, n_cand=2048):
+    """Coarse grid on the subsample, then GP/expected-improvement proposals on the full set.
+
+    The best coarse points seed the model; each round proposes the `batch` points
+    with the highest expected improvement inside the grid box (widened by one grid
+    step), and the search stops after `patience` rounds without a gain > tol.
+    """
+    rng = np.random.default_rng(seed)
+    da, db = _spacing(alphas), _spacing(betas)
+    lo = np.array([max(min(alphas) - da, 0.0), min(betas) - db])
+    hi = np.array([max(alphas) + da, max(betas) + db])
+    ls = np.maximum(0.3 * (hi - lo), 1e-3)
+
+    X = _coarse(log, alphas, betas, sub, seed)[:min(3, max_evals)]
+    y = log.run(FULL, X)
+    best_w = min(y)
+    stale = 0
+    while len(X) < max_evals and stale < patience:
+        cand = lo + rng.random((n_cand, 2)) * (hi - lo)
+        mu, sd = _gp_posterior(np.array(X), np.array(y), cand, ls)
+        ei = _expected_improvement(mu, sd, best_w)
+        picks, seen = [], set(X)
+        for i in np.argsort(-ei):
+            p = _point(*cand[i])
+            if p not in seen:
+                picks.append(p)
+                seen.add(p)
+            if len(picks) >= min(batch, max_evals - len(X)):
+                break
+        ws = log.run(FULL, picks)
+        X += picks
+        y += ws
+        if min(ws) < best_w - tol:
+            best_w, stale = min(ws), 0
+        else:
+            stale += 1
+    i = int(np.argmin(y))
+    return X[i], y[i]
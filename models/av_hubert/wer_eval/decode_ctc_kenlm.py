@@ -1,7 +1,11 @@
-import argparse, json, os
+import argparse, json, os, re, time
+from collections import defaultdict
+from multiprocessing import Pool
 import numpy as np
 from pyctcdecode import build_ctcdecoder
 from .normalize import normalize_text
+from .logprob_store import iter_ctc_items, load_logprobs, as_float32
+from .edit_distance import word_errors
 
 def load_labels(vocab_path: str):
     # supports vocab.txt (one token per line) OR vocab.json mapping index->token
@@ -14,33 +18,172 @@ def load_labels(vocab_path: str):
     else:
         return [l.rstrip("\n") for l in open(vocab_path, "r", encoding="utf-8")]
 
+def blank_index(labels):
+    # pyctcdecode treats "" (or a "<pad>"/"[pad]" token) as the CTC blank; None when the vocab has neither
+    for i, l in enumerate(labels):
+        if l == "" or re.match(r"^[<\[]pad[>\]]$", l, flags=re.IGNORECASE):
+            return i
+    return None
+
+def skip_blank_frames(lp, blank_id, threshold):
+    """Collapse each run of frames with P(blank) > threshold into its first frame.
+
+    One frame of every run is kept, so blanks separating repeated labels survive;
+    beam search sees far fewer frames. With threshold >= 0.5 a skipped frame has
+    blank as its argmax, so the greedy CTC path is unchanged; main() enforces that.
+    """
+    is_blank = lp[:, blank_id] > np.log(threshold)
+    keep = np.ones(len(lp), dtype=bool)
+    keep[1:] = ~(is_blank[1:] & is_blank[:-1])
+    return lp[keep]
+
+# per-process decoder, built once by _init_worker; _skip is (blank_id, threshold, also_decode_full) or None
+_decoder = None
+_skip = None
+
+def _init_worker(labels, lm_bin, alpha, beta, skip=None):
+    global _decoder, _skip
+    _skip = skip
+    try:
+        # alpha/beta are decoder params in pyctcdecode, not decode() kwargs
+        _decoder = build_ctcdecoder(labels, kenlm_model_path=lm_bin, alpha=alpha, beta=beta)
+    except Exception as e:
+        # a raising initializer makes Pool respawn workers forever; fail on first task instead
+        _decoder = e
+
+def _decode_item(job):
+    if isinstance(_decoder, Exception):
+        raise _decoder
+    it, alpha, beta = job
+    t0 = time.perf_counter()
+    lp = as_float32(load_logprobs(it))
+    n_frames = len(lp)
+    full = None
+    if _skip is not None:
+        if _skip[2]:
+            # reference decode for the WER delta; kept out of the throughput numbers
+            t1 = time.perf_counter()
+            full = normalize_text(_decoder.decode(lp))
+            t0 += time.perf_counter() - t1
+        lp = skip_blank_frames(lp, _skip[0], _skip[1])
+    hyp = _decoder.decode(lp)
+    out = {
+        "utt_id": it.get("utt_id"),
+        "ref": it.get("ref",""),
+        "hyp": normalize_text(hyp),
+        "alpha": alpha,
+        "beta": beta
+    }
+    if full is not None:
+        out["hyp_noskip"] = full
+    return out, os.getpid(), time.perf_counter() - t0, n_frames, len(lp)
+
+def iter_decoded(items, labels, lm_bin, alpha, beta, workers=1, chunksize=8, skip=None):
+    """Yield (out, pid, decode seconds, frames in, frames decoded) for every item, in input order."""
+    jobs = ((it, alpha, beta) for it in items)
+    initargs = (labels, lm_bin, alpha, beta, skip)
+    if workers <= 1:
+        _init_worker(*initargs)
+        yield from map(_decode_item, jobs)
+        return
+    with Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+        yield from pool.imap(_decode_item, jobs, chunksize=chunksize)
+
+def report_throughput(stats):
+    # stats: pid -> [n_utts, busy_seconds]
+    for i, (pid, (n, busy)) in enumerate(sorted(stats.items())):
+        ups = n / busy if busy > 0 else 0.0
+        print(f"worker {i} (pid {pid}): {n} utts, {ups:.2f} utt/s")
+
+def completed_utt_ids(path):
+    """utt_ids already written to `path`; a partial last line left by a crash is cut off."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        good = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            if line.strip():
+                done.add(json.loads(line).get("utt_id"))
+            good += len(line)
+        f.truncate(good)
+    done.discard(None)
+    return done
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--ctc_jsonl", required=True, help="Each line: {utt_id, ref, logprobs_path, vocab_path}")
+    ap.add_argument("--ctc_jsonl", required=True, help="Each line: {utt_id, ref, logprobs_path, vocab_path}; or a pack dir from wer_eval.logprob_store")
     ap.add_argument("--lm_bin", required=True)
     ap.add_argument("--alpha", type=float, required=True)
     ap.add_argument("--beta", type=float, required=True)
     ap.add_argument("--out_jsonl", required=True)
+    ap.add_argument("--workers", type=int, default=1, help="decoder processes; each builds its own decoder once")
+    ap.add_argument("--chunksize", type=int, default=8, help="utterances handed to a worker at a time")
+    ap.add_argument("--resume", action="store_true", help="keep utts already in --out_jsonl and append only the missing ones")
+    ap.add_argument("--flush_every", type=int, default=256, help="buffered output lines written and flushed together")
+    ap.add_argument("--blank_skip", type=float, default=0.0,
+                    help="collapse runs of frames with P(blank) above this (0.5 <= p < 1, e.g. 0.999) before beam search; 0 = off")
+    ap.add_argument("--blank_id", type=int, default=-1, help="blank index in the vocab; default: the ''/<pad> label, required if there is none")
+    ap.add_argument("--blank_skip_eval", action="store_true",
+                    help="also decode without skipping (hyp_noskip) and report the WER delta")
     args = ap.parse_args()
+    if args.blank_skip and not 0.5 <= args.blank_skip < 1:
+        ap.error("--blank_skip must be 0 (off) or in [0.5, 1): below 0.5 skipped frames can carry non-blank labels")
 
-    # build decoder once using labels from first line
-    first = json.loads(open(args.ctc_jsonl, "r", encoding="utf-8").readline())
+    # build decoder labels once using the first line
+    first = next(iter_ctc_items(args.ctc_jsonl))
     labels = load_labels(first["vocab_path"])
-    decoder = build_ctcdecoder(labels, kenlm_model_path=args.lm_bin)
-
-    with open(args.ctc_jsonl, "r", encoding="utf-8") as fin, open(args.out_jsonl, "w", encoding="utf-8") as fout:
-        for line in fin:
-            it = json.loads(line)
-            lp = np.load(it["logprobs_path"])
-            hyp = decoder.decode(lp, alpha=args.alpha, beta=args.beta)
-            out = {
-                "utt_id": it.get("utt_id"),
-                "ref": it.get("ref",""),
-                "hyp": normalize_text(hyp),
-                "alpha": args.alpha,
-                "beta": args.beta
-            }
-            fout.write(json.dumps(out, ensure_ascii=False) + "\n")
+    skip = None
+    if args.blank_skip > 0:
+        blank_id = args.blank_id if args.blank_id >= 0 else blank_index(labels)
+        if blank_id is None:
+            raise SystemExit(f"No ''/<pad> blank label in {first['vocab_path']}; pass --blank_id with --blank_skip.")
+        if blank_id >= len(labels):
+            raise SystemExit(f"--blank_id {blank_id} is out of range for a vocab of {len(labels)} labels.")
+        skip = (blank_id, args.blank_skip, args.blank_skip_eval)
+
+    done = completed_utt_ids(args.out_jsonl) if args.resume else set()
+    if done:
+        print(f"Resuming: {len(done)} utts already in {args.out_jsonl}")
+
+    stats = defaultdict(lambda: [0, 0.0])
+    t0 = time.perf_counter()
+    n = 0
+    frames_in = frames_kept = 0
+    n_ref = err_skip = err_full = 0
+    buf = []
+    with open(args.out_jsonl, "a" if args.resume else "w", encoding="utf-8") as fout:
+        items = (it for it in iter_ctc_items(args.ctc_jsonl) if it.get("utt_id") not in done)
+        for out, pid, dt, f_in, f_kept in iter_decoded(items, labels, args.lm_bin, args.alpha, args.beta,
+                                                       workers=args.workers, chunksize=args.chunksize, skip=skip):
+            buf.append(json.dumps(out, ensure_ascii=False) + "\n")
+            if len(buf) >= args.flush_every:
+                fout.write("".join(buf))
+                fout.flush()
+                buf.clear()
+            stats[pid][0] += 1
+            stats[pid][1] += dt
+            n += 1
+            frames_in += f_in
+            frames_kept += f_kept
+            if "hyp_noskip" in out:
+                ref = normalize_text(out["ref"]).split()
+                n_ref += len(ref)
+                err_skip += word_errors(ref, out["hyp"].split())
+                err_full += word_errors(ref, out["hyp_noskip"].split())
+        fout.write("".join(buf))
+    wall = time.perf_counter() - t0
+    print(f"Decoded {n} utts in {wall:.1f}s ({n / max(wall, 1e-9):.2f} utt/s total)")
+    report_throughput(stats)
+    if skip is not None:
+        print(f"Blank skip (p>{args.blank_skip}): decoded {frames_kept}/{frames_in} frames "
+              f"({frames_kept / max(frames_in, 1):.3f} kept)")
+        if args.blank_skip_eval and n_ref:
+            w_skip, w_full = err_skip / n_ref, err_full / n_ref
+            print(f"WER with skip {w_skip*100:.2f}% vs without {w_full*100:.2f}% "
+                  f"(delta {(w_skip - w_full)*100:+.2f}%)")
 
 if __name__ == "__main__":
     main()
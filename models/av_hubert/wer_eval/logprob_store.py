@@ -0,0 +1,115 @@
+"""Packed CTC logprob store.
+
+A pack is a directory with one or more shard_XXX.npy files holding the frames
+of many utterances end to end, plus index.npz (shard, offset, length, vocab_id
+per utterance) and meta.json (utt_ids, refs, vocab paths, shard file names).
+Readers memory-map the shards, so an utterance is a zero-copy slice.
+
+Convert a per-file --ctc_jsonl layout with:
+  python -m wer_eval.logprob_store --ctc_jsonl work/test_ctc.jsonl --out_dir work/test_ctc.pack
+"""
+import argparse, json, os
+import numpy as np
+
+# shard path -> memmap, opened lazily once per process
+_shards = {}
+
+def is_pack(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "index.npz"))
+
+def iter_ctc_items(path: str):
+    """Yield CTC items from a --ctc_jsonl file or a pack directory.
+
+    Items from a pack carry shard/offset/length instead of logprobs_path;
+    use load_logprobs() to read either kind.
+    """
+    if not is_pack(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+        return
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    idx = np.load(os.path.join(path, "index.npz"))
+    shards = [os.path.join(path, s) for s in meta["shards"]]
+    for i, utt_id in enumerate(meta["utt_ids"]):
+        yield {
+            "utt_id": utt_id,
+            "ref": meta["refs"][i],
+            "vocab_path": meta["vocabs"][int(idx["vocab_id"][i])],
+            "shard": shards[int(idx["shard"][i])],
+            "offset": int(idx["offset"][i]),
+            "length": int(idx["length"][i]),
+        }
+
+def load_logprobs(it):
+    """(T, V) logprobs of one item as a read-only memmap view; cast before heavy math."""
+    if "shard" not in it:
+        return np.load(it["logprobs_path"], mmap_mode="r")
+    arr = _shards.get(it["shard"])
+    if arr is None:
+        arr = _shards[it["shard"]] = np.load(it["shard"], mmap_mode="r")
+    return arr[it["offset"]:it["offset"] + it["length"]]
+
+def as_float32(lp):
+    # float16 packs are widened per utterance; float32/float64 arrays pass through unchanged
+    return lp.astype(np.float32) if lp.dtype == np.float16 else lp
+
+def pack_ctc_jsonl(ctc_jsonl: str, out_dir: str, dtype="float16", shard_mb=1024):
+    items = [json.loads(l) for l in open(ctc_jsonl, "r", encoding="utf-8")]
+    dtype = np.dtype(dtype)
+    limit = shard_mb * (1 << 20)
+
+    # plan: a new shard when it would outgrow the limit or the vocab size changes
+    vocabs, plan, shard_shapes = {}, [], []
+    for it in items:
+        T, V = np.load(it["logprobs_path"], mmap_mode="r").shape
+        vid = vocabs.setdefault(it["vocab_path"], len(vocabs))
+        if not shard_shapes or shard_shapes[-1][1] != V or \
+                (shard_shapes[-1][0] and (shard_shapes[-1][0] + T) * V * dtype.itemsize > limit):
+            shard_shapes.append([0, V])
+        plan.append((len(shard_shapes) - 1, shard_shapes[-1][0], T, vid))
+        shard_shapes[-1][0] += T
+
+    os.makedirs(out_dir, exist_ok=True)
+    names = [f"shard_{k:03d}.npy" for k in range(len(shard_shapes))]
+    k_open, out = -1, None
+    for it, (k, off, T, _) in zip(items, plan):
+        if k != k_open:
+            if out is not None:
+                out.flush()
+            out = np.lib.format.open_memmap(os.path.join(out_dir, names[k]), mode="w+",
+                                            dtype=dtype, shape=tuple(shard_shapes[k]))
+            k_open = k
+        out[off:off + T] = np.load(it["logprobs_path"])
+    if out is not None:
+        out.flush()
+        del out
+
+    plan = np.asarray(plan, dtype=np.int64).reshape(-1, 4)
+    np.savez(os.path.join(out_dir, "index.npz"),
+             shard=plan[:, 0].astype(np.int32), offset=plan[:, 1],
+             length=plan[:, 2].astype(np.int32), vocab_id=plan[:, 3].astype(np.int32))
+    meta = {
+        "utt_ids": [it.get("utt_id") for it in items],
+        "refs": [it.get("ref","") for it in items],
+        "vocabs": [p for p, _ in sorted(vocabs.items(), key=lambda x: x[1])],
+        "shards": names,
+        "dtype": dtype.name,
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return len(items), int(plan[:, 2].sum()) if len(plan) else 0, len(names)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ctc_jsonl", required=True, help="Each line: {utt_id, ref, logprobs_path, vocab_path}")
+    ap.add_argument("--out_dir", required=True)
+    ap.add_argument("--dtype", choices=["float16","float32"], default="float16")
+    ap.add_argument("--shard_mb", type=int, default=1024)
+    args = ap.parse_args()
+    n, frames, shards = pack_ctc_jsonl(args.ctc_jsonl, args.out_dir, args.dtype, args.shard_mb)
+    print(f"Packed {n} utts / {frames} frames into {shards} shard(s) under {args.out_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,8 @@ args["PRETRAIN_VAL_SPLIT"] = 0.01  # Validation set size fraction during pretrai
 args["NUM_WORKERS"] = 4  # DataLoader num_workers argument
 args["PRETRAIN_NUM_WORDS"] = 1  # Number of words limit in current curriculum learning iteration
 args["MAIN_REQ_INPUT_LENGTH"] = 100  # Minimum input length while training
+args["SPLIT_WORKERS"] = os.cpu_count() or 1  # Processes splitting over-long utterances (ffmpeg stream copy)
+args["FEATURE_STORE"] = str(data_root / "feature_store")  # Packed float16 features and encoded targets; None reads per-sample .npy/.txt files
 
 args["CHAR_TO_INDEX"] = {
     " ": 1, "'": 22, "1": 30, "0": 29, "3": 37, "2": 32, "5": 34, "4": 38, "7": 36, "6": 35, "9": 31, "8": 33,
@@ -46,10 +48,15 @@ args["VIDEO_FPS"] = 25  # Frame rate of the video clips
 args["ROI_SIZE"] = 112  # Height and width of input greyscale lip region patch
 args["NORMALIZATION_MEAN"] = 0.4161  # Mean value for normalization of greyscale lip region patch
 args["NORMALIZATION_STD"] = 0.1688  # Standard deviation value for normalization of greyscale lip region patch
+args["PREPROCESS_WORKERS"] = 4  # Threads decoding and cropping videos ahead of the visual frontend
+args["PREPROCESS_BATCH_FRAMES"] = 512  # Maximum total frames of the clips run through the visual frontend together
+args["SAVE_ROI_MONTAGE"] = False  # Whether to also write the <name>.png montage of the lip regions of each clip
+args["PREPROCESS_OVERWRITE"] = False  # Whether to re-extract samples whose outputs already exist
 
 # Training
 args["SEED"] = 19220297  # Seed for random number generators
-args["BATCH_SIZE"] = 16  # Minibatch size
+args["BATCH_SIZE"] = 16  # Maximum number of clips in a minibatch
+args["MAX_BATCH_FRAMES"] = 2400  # Frame budget of a minibatch (clips x longest clip after padding); bounds memory per step
 args["STEP_SIZE"] = 100  # Number of samples in one step (virtual epoch)
 args["NUM_STEPS"] = 1600  # Maximum number of steps to train for (early stopping is used)
 args["SAVE_FREQUENCY"] = 100  # Saving the model weights and loss/metric plots after every these many steps
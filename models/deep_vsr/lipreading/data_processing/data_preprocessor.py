@@ -7,7 +7,7 @@ import torch
 from tqdm import tqdm
 from lipreading.config import args
 from lipreading.models.visual_frontend import VisualFrontend
-from lipreading.utils.preprocessing import preprocess_sample
+from lipreading.utils.preprocessing import iterate_roi_sequences, save_roi_montage, extract_visual_features, save_features
 
 class DataPreprocessor:
     def __init__(self):
@@ -31,6 +31,46 @@ class DataPreprocessor:
         shutil.move(self.split_output_folder, self.main_folder)
         print(f"Moved 'split_output' to '{self.main_folder}'.")
     
+    @staticmethod
+    def _is_done(file, save_roi):
+        """
+        Whether a sample already has its features (and ROI montage, if requested).
+        """
+        return os.path.exists(file + ".npy") and (not save_roi or os.path.exists(file + ".png"))
+
+    def extract_features(self, files_list, vf, device, save_roi):
+        """
+        Decodes and crops the videos on PREPROCESS_WORKERS threads feeding a bounded queue, while the main thread
+        runs the visual frontend over batches of whole clips of up to PREPROCESS_BATCH_FRAMES frames in total and
+        saves the features of each clip.
+        """
+        roi_size = args["ROI_SIZE"]
+        norm_mean = args["NORMALIZATION_MEAN"]
+        norm_std = args["NORMALIZATION_STD"]
+        max_frames = args["PREPROCESS_BATCH_FRAMES"]
+        num_workers = args["PREPROCESS_WORKERS"]
+
+        def flush(batch):
+            features = extract_visual_features(vf, [rois for _, rois in batch], norm_mean, norm_std, device)
+            for (file, _), out in zip(batch, features):
+                save_features(file + ".npy", out)
+
+        batch, batch_frames = [], 0
+        clips = iterate_roi_sequences(files_list, roi_size, num_workers, 4 * num_workers)
+        for file, rois in tqdm(clips, total=len(files_list), leave=True, desc="Preprocess", ncols=75):
+            if len(rois) == 0:
+                print(f"\nNo frames decoded from {file}.mp4, skipping.")
+                continue
+            if save_roi:
+                save_roi_montage(file + ".png", rois)
+            if batch and batch_frames + len(rois) > max_frames:
+                flush(batch)
+                batch, batch_frames = [], 0
+            batch.append((file, rois))
+            batch_frames += len(rois)
+        if batch:
+            flush(batch)
+
     def preprocess_data(self):
         """
         Preprocesses the data by extracting and normalizing visual features.
@@ -47,6 +87,7 @@ class DataPreprocessor:
         vf = VisualFrontend()
         vf.load_state_dict(torch.load(args["TRAINED_FRONTEND_FILE"], map_location=device))
         vf.to(device)
+        vf.eval()
 
         # Walking through the data directory and obtaining a list of all files in the dataset
         files_list = []
@@ -54,20 +95,18 @@ class DataPreprocessor:
             for file in files:
                 if file.endswith(".mp4"):
                     files_list.append(os.path.join(root, file[:-4]))
+        files_list.sort()
+
+        # Samples whose outputs already exist are skipped so an interrupted run can be resumed
+        save_roi = args["SAVE_ROI_MONTAGE"]
+        if not args["PREPROCESS_OVERWRITE"]:
+            files_list = [file for file in files_list if not self._is_done(file, save_roi)]
 
-        # Preprocessing each sample
+        # Preprocessing the samples
         print(f"\nNumber of data samples to be processed = {len(files_list)}")
         print("\n\nStarting preprocessing ....\n")
-
-        params = {
-            "roiSize": args["ROI_SIZE"],
-            "normMean": args["NORMALIZATION_MEAN"],
-            "normStd": args["NORMALIZATION_STD"],
-            "vf": vf
-        }
-
-        for file in tqdm(files_list, leave=True, desc="Preprocess", ncols=75):
-            preprocess_sample(file, params)
+        if files_list:
+            self.extract_features(files_list, vf, device, save_roi)
 
         print("\nPreprocessing Done.")
 
@@ -1,21 +1,104 @@
 # label_video_splitter.py
 
 import os
+import json
+import subprocess
+from multiprocessing import Pool
 from shutil import copyfile
-from moviepy.video.io.VideoFileClip import VideoFileClip
 from lipreading.config import args
 
+
+def probe_keyframes(video_path):
+    """
+    Returns the sorted times (in seconds from the start of the file, as ffmpeg -ss counts them) of the keyframes of
+    the first video stream. Only packet headers are read, nothing is decoded.
+    """
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries",
+           "packet=pts_time,flags:format=start_time", "-of", "json", video_path]
+    probe = json.loads(subprocess.run(cmd, check=True, capture_output=True, text=True).stdout)
+    start_time = float(probe.get("format", {}).get("start_time", 0.0))
+    times = [float(p["pts_time"]) - start_time for p in probe.get("packets", [])
+             if "K" in p.get("flags", "") and p.get("pts_time") not in (None, "N/A")]
+    return sorted(times)
+
+
+def probe_duration(video_path):
+    """
+    Returns the duration in seconds of the first video stream.
+    """
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=duration", "-of", "json",
+           video_path]
+    probe = json.loads(subprocess.run(cmd, check=True, capture_output=True, text=True).stdout)
+    return float(probe["streams"][0]["duration"])
+
+
+def durations_match(videos, spans, tolerance=0.15):
+    """
+    Checks that each video lasts as long as its (start, end) span, up to tolerance seconds (a few frames).
+    """
+    return all(abs(probe_duration(video) - (end - start)) <= tolerance for video, (start, end) in zip(videos, spans))
+
+
+def split_at_keyframe(input_video, part1_video, part2_video, start_time, cut_time, end_time):
+    """
+    Cuts the video into [start_time, cut_time) and [cut_time, end_time) without re-encoding. start_time and cut_time
+    must be keyframe times: the segment muxer splits there on the keyframe packets themselves, so neither part gets
+    frames of the other. Part 2 is then trimmed to end_time by a second stream copy.
+    """
+    rest_video = part2_video + ".rest.mp4"
+    pattern = part2_video + ".seg%d.mp4"
+    times = [cut_time] if start_time <= 0 else [start_time, cut_time]
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", input_video, "-map", "0:v:0", "-map", "0:a?", "-c", "copy",
+           "-f", "segment", "-segment_times", ",".join([f"{t:.6f}" for t in times]), "-segment_time_delta", "0.005",
+           "-reset_timestamps", "1", pattern]
+    subprocess.run(cmd, check=True)
+    if len(times) > 1:
+        os.remove(pattern % 0)
+    os.replace(pattern % (len(times) - 1), part1_video)
+    os.replace(pattern % len(times), rest_video)
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", rest_video, "-t", f"{end_time - cut_time:.6f}",
+           "-map", "0:v:0", "-map", "0:a?", "-c", "copy", part2_video]
+    subprocess.run(cmd, check=True)
+    os.remove(rest_video)
+
+
+def reencode(input_video, output_video, start, end):
+    """
+    Frame-accurate cut of [start, end) with a fast H.264/AAC re-encode, for cuts that do not fall on a keyframe.
+    """
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-ss", f"{start:.6f}", "-i", input_video, "-t", f"{end - start:.6f}",
+           "-map", "0:v:0", "-map", "0:a?", "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", output_video]
+    subprocess.run(cmd, check=True)
+
+
+def link_or_copy(src, dst):
+    """
+    Hard-links src to dst, falling back to a copy where links are not possible (e.g. across file systems).
+    """
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        copyfile(src, dst)
+
+
 class LabelVideoSplitter:
     def __init__(self):
         self.processed_mp4_folder = os.path.join(args["DATA_DIRECTORY"], 'processed_mp4')
         self.output_folder = os.path.join(args["DATA_DIRECTORY"], 'split_output')
         self.max_chars = args["MAIN_REQ_INPUT_LENGTH"]  # Character limit from config.py
+        self.num_workers = args["SPLIT_WORKERS"]
         if not os.path.exists(self.output_folder):
             os.makedirs(self.output_folder)
-        
+
     def process_label_file(self, label_file, input_video):
         """
         Splits label and video files based on word splits if text exceeds max_chars.
+        Part 2 starts at the last keyframe in the pause between the two halves when there is one, and part 1 at the
+        last keyframe up to its first word, so both parts are cut by stream copy; otherwise both parts are re-encoded,
+        each starting at its first word. Word times are shifted to the start of their part, and stream-copied parts
+        whose durations do not match their label spans are re-encoded.
         """
         # Read the label file
         with open(label_file, 'r', encoding='utf-8') as f:
@@ -31,22 +114,21 @@ class LabelVideoSplitter:
         # **Step 1**: Check if the text exceeds max_chars
         if len(text_line) <= self.max_chars:
             print(f"Label file {label_file} has {len(text_line)} characters. No split needed.")
-            
-            # Copy the original video and label to the output folder
+
+            # Link the original video and label into the output folder
             base_name = os.path.splitext(os.path.basename(label_file))[0]
             output_label_path = os.path.join(self.output_folder, f"{base_name}.txt")
             output_video_path = os.path.join(self.output_folder, f"{base_name}.mp4")
-            
-            # Copy label and video
-            copyfile(label_file, output_label_path)
-            copyfile(input_video, output_video_path)
-            
-            print(f"Copied original {output_video_path} and {output_label_path} to {self.output_folder}")
+
+            link_or_copy(label_file, output_label_path)
+            link_or_copy(input_video, output_video_path)
+
+            print(f"Linked original {output_video_path} and {output_label_path} into {self.output_folder}")
             return
 
         # **Step 2**: Split based on the number of words
         total_words = len(words_info)
-        
+
         # Determine split point
         split_index = total_words // 2 + (total_words % 2)
 
@@ -64,24 +146,39 @@ class LabelVideoSplitter:
         part2_start_time_original = float(part2_labels[0].split()[1])
         part2_end_time = float(part2_labels[-1].split()[2])
 
+        # Cut at the latest keyframe in the pause between the last word of part 1 and the first word of part 2,
+        # and start part 1 at the latest keyframe up to its first word
+        keyframes = probe_keyframes(input_video)
+        cuts = [t for t in keyframes if part1_end_time <= t <= part2_start_time_original + 1e-3]
+        use_stream_copy = len(cuts) > 0
+        cut_time = cuts[-1] if use_stream_copy else part2_start_time_original
+        starts = [t for t in keyframes if t <= part1_start_time + 1e-3]
+        part1_start = (starts[-1] if len(starts) > 0 else 0.0) if use_stream_copy else part1_start_time
+
         # **Step 3**: Write new label files for part 1 and part 2 in the new folder
         base_name = os.path.splitext(os.path.basename(label_file))[0]
 
+        # Adjust timings for part 1 to start from 0.0s at its start
+        new_part1_labels = []
+        for label in part1_labels:
+            word, start, end = label.strip().split()
+            new_part1_labels.append(f"{word} {float(start) - part1_start:.2f} {float(end) - part1_start:.2f}\n")
+
         # Write Part 1 label
         part1_label_file = os.path.join(self.output_folder, f"{base_name}_part_1.txt")
         with open(part1_label_file, 'w', encoding='utf-8') as f:
             f.write(f"Text: {part1_text}\n")
             f.write("Conf: 1\n\n")
             f.write("WORD START END\n")
-            f.writelines(part1_labels)
+            f.writelines(new_part1_labels)
             f.write("\n")
 
-        # Adjust timings for part 2 to start from 0.0s
+        # Adjust timings for part 2 to start from 0.0s at the cut
         new_part2_labels = []
         for label in part2_labels:
             word, start, end = label.strip().split()
-            new_start = float(start) - part2_start_time_original  # Adjust start time
-            new_end = float(end) - part2_start_time_original  # Adjust end time
+            new_start = float(start) - cut_time  # Adjust start time
+            new_end = float(end) - cut_time  # Adjust end time
             new_part2_labels.append(f"{word} {new_start:.2f} {new_end:.2f}\n")
 
         # Write Part 2 label
@@ -92,30 +189,44 @@ class LabelVideoSplitter:
             f.write("WORD START END\n")
             f.writelines(new_part2_labels)
 
-        # **Step 4**: Crop and save the videos for each part
+        # **Step 4**: Cut and save the videos for each part
         part1_video_file = os.path.join(self.output_folder, f"{base_name}_part_1.mp4")
         part2_video_file = os.path.join(self.output_folder, f"{base_name}_part_2.mp4")
 
-        with VideoFileClip(input_video) as video:
-            # Save Part 1: from the start to the start time of part 2
-            part1_clip = video.subclip(part1_start_time, part2_start_time_original)
-            part1_clip.write_videofile(part1_video_file, codec="libx264", audio_codec="aac", verbose=False, logger=None)
-            
-            # Save Part 2: from the start time of part 2 to the end
-            part2_clip = video.subclip(part2_start_time_original, part2_end_time)
-            part2_clip.write_videofile(part2_video_file, codec="libx264", audio_codec="aac", verbose=False, logger=None)
-
-        print(f"Processed: {part1_video_file} and {part2_video_file} with corresponding label files.")
-    
+        videos = [part1_video_file, part2_video_file]
+        spans = [(part1_start, cut_time), (cut_time, part2_end_time)]
+        if use_stream_copy:
+            split_at_keyframe(input_video, part1_video_file, part2_video_file, part1_start, cut_time, part2_end_time)
+            if not durations_match(videos, spans):
+                print(f"Stream-copied parts of {input_video} do not match their label times, re-encoding.")
+                use_stream_copy = False
+        if not use_stream_copy:
+            for video, (start, end) in zip(videos, spans):
+                reencode(input_video, video, start, end)
+            if not durations_match(videos, spans):
+                print(f"Warning: split parts of {input_video} do not match their label times.")
+
+        mode = "stream copy" if use_stream_copy else "re-encode"
+        print(f"Processed ({mode}): {part1_video_file} and {part2_video_file} with corresponding label files.")
+
+    def _process_pair(self, pair):
+        label_path, video_path = pair
+        self.process_label_file(label_path, video_path)
+        return label_path
+
     def process_all_videos_labels(self):
         """
-        Processes all video-label pairs and saves them to the split_output folder.
+        Processes all video-label pairs on a pool of SPLIT_WORKERS processes and saves them to the split_output folder.
         """
-        splitter = LabelVideoSplitter()
-        video_files = sorted([f for f in os.listdir(splitter.processed_mp4_folder) if f.endswith('.mp4')])
-        label_files = sorted([f for f in os.listdir(splitter.processed_mp4_folder) if f.endswith('.txt')])
-
-        for video_file, label_file in zip(video_files, label_files):
-            video_path = os.path.join(splitter.processed_mp4_folder, video_file)
-            label_path = os.path.join(splitter.processed_mp4_folder, label_file)
-            splitter.process_label_file(label_path, video_path)
+        video_files = sorted([f for f in os.listdir(self.processed_mp4_folder) if f.endswith('.mp4')])
+        label_files = sorted([f for f in os.listdir(self.processed_mp4_folder) if f.endswith('.txt')])
+        pairs = [(os.path.join(self.processed_mp4_folder, label_file), os.path.join(self.processed_mp4_folder, video_file))
+                 for video_file, label_file in zip(video_files, label_files)]
+
+        if self.num_workers > 1 and len(pairs) > 1:
+            with Pool(self.num_workers) as pool:
+                for _ in pool.imap_unordered(self._process_pair, pairs, chunksize=4):
+                    pass
+        else:
+            for pair in pairs:
+                self._process_pair(pair)
@@ -0,0 +1,243 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+#Packed visual-feature store: the frontend features of every sample back to back in one raw float16 file, plus an
+#index mapping each sample to its feature rows, its encoded target and its word timing rows.
+#   features.f16 - float16 (totalFrames, featureDim)
+#   index.npz    - names, offsets, lengths (feature rows), trgt, trgtOffsets, trgtLengths (charToIx indices, no <EOS>),
+#                  wordStarts (character position of each word in the target, one extra end entry per sample),
+#                  wordOffsets, wordCounts, times, timeOffsets, timeCounts (word start/end seconds, float64 (N,2))
+#   meta.json    - feature dim, dtype, counts, the charToIx mapping the targets were encoded with and a digest of the
+#                  sample names of each split list that was packed
+FEATURES_FILE = "features.f16"
+INDEX_FILE = "index.npz"
+META_FILE = "meta.json"
+
+
+
+class FeatureStore:
+
+    """
+    Read-only view of a store written by pack_features. The feature file is memory-mapped on first use so a sample
+    reads only its own rows; DataLoader workers reopen the map instead of pickling it.
+    """
+
+    def __init__(self, storeDir):
+        self.storeDir = storeDir
+        with open(os.path.join(storeDir, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        index = np.load(os.path.join(storeDir, INDEX_FILE))
+        self.names = [str(name) for name in index["names"]]
+        self.offsets = index["offsets"]
+        self.lengths = index["lengths"]
+        self.trgt = index["trgt"]
+        self.trgtOffsets = index["trgtOffsets"]
+        self.trgtLengths = index["trgtLengths"]
+        self.wordStarts = index["wordStarts"]
+        self.wordOffsets = index["wordOffsets"]
+        self.wordCounts = index["wordCounts"]
+        self.times = index["times"]
+        self.timeOffsets = index["timeOffsets"]
+        self.timeCounts = index["timeCounts"]
+        self.pos = {name: i for i, name in enumerate(self.names)}
+        self._features = None
+        return
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_features"] = None
+        return state
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    @property
+    def features(self):
+        if self._features is None:
+            self._features = np.memmap(os.path.join(self.storeDir, FEATURES_FILE), dtype=np.float16, mode="r",
+                                       shape=(int(self.meta["frames"]), int(self.meta["featureDim"])))
+        return self._features
+
+
+    def index(self, name):
+        if name not in self.pos:
+            raise KeyError(f"{name} is not in feature store {self.storeDir}")
+        return self.pos[name]
+
+
+    def check_char_to_ix(self, charToIx):
+        if self.meta["charToIx"] != charToIx:
+            raise ValueError(f"Feature store {self.storeDir} was packed with a different CHAR_TO_INDEX mapping")
+        return
+
+
+    def stale_reason(self, datadir, datasets):
+        """
+        Why the store cannot stand in for the per-sample files of the given split lists (None if it can): a list that
+        was not packed or has changed since, or a listed .npy/.txt file modified after the store was written.
+        """
+        packed = self.meta.get("lists", dict())
+        written = os.path.getmtime(os.path.join(self.storeDir, INDEX_FILE))
+        for dataset in datasets:
+            names = list_names(datadir, dataset)
+            if dataset not in packed:
+                return f"the {dataset} list was not packed"
+            if packed[dataset] != names_digest(names):
+                return f"the {dataset} list has changed since it was packed"
+            for name in names:
+                for ext in (".npy", ".txt"):
+                    if os.path.getmtime(datadir + "/" + name + ext) > written:
+                        return f"{name}{ext} is newer than the store"
+        return None
+
+
+    def feats(self, i, start=0, end=None):
+        """
+        Feature rows [start, end) of sample i as float32, read straight from the memory map.
+        """
+        length = int(self.lengths[i])
+        end = length if end is None else min(end, length)
+        start = min(start, end)
+        o = int(self.offsets[i])
+        return np.asarray(self.features[o+start:o+end], dtype=np.float32)
+
+
+    def target(self, i, start=0, end=None):
+        """
+        Encoded target characters [start, end) of sample i (without <EOS>).
+        """
+        length = int(self.trgtLengths[i])
+        end = length if end is None else end
+        o = int(self.trgtOffsets[i])
+        return self.trgt[o+start:o+end].astype(np.int64)
+
+
+    def word_starts(self, i):
+        """
+        Character position of each word of sample i's target, followed by len(target)+1.
+        """
+        o = int(self.wordOffsets[i])
+        return self.wordStarts[o:o+int(self.wordCounts[i])+1]
+
+
+    def word_times(self, i):
+        o = int(self.timeOffsets[i])
+        return self.times[o:o+int(self.timeCounts[i])]
+
+
+
+def list_names(datadir, dataset):
+
+    """
+    Store names of the samples of a split list: paths relative to datadir, under pretrain/ for the pretrain/preval
+    lists and under main/ for all others, the same as LRS2Pretrain and LRS2Main.
+    """
+
+    subdir = "pretrain" if dataset in ("pretrain", "preval") else "main"
+    with open(datadir + "/" + dataset + ".txt", "r") as f:
+        return [subdir + "/" + line.strip().split(" ")[0] for line in f.readlines() if line.strip()]
+
+
+
+def names_digest(names):
+    return hashlib.sha1("\n".join(names).encode("utf-8")).hexdigest()
+
+
+
+def parse_target_file(targetFile):
+
+    """
+    Reads a target file the way prepare_main_input/prepare_pretrain_input do: the target text and the (start, end)
+    times on the word lines following the header (NaN where a line carries no times).
+    """
+
+    with open(targetFile, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f.readlines()]
+    trgt = lines[0][7:]
+    times = list()
+    for line in lines[4:]:
+        fields = line.split(" ")
+        try:
+            times.append((float(fields[1]), float(fields[2])))
+        except (IndexError, ValueError):
+            times.append((np.nan, np.nan))
+    return trgt, np.array(times, dtype=np.float64).reshape(-1, 2)
+
+
+
+def pack_features(datadir, datasets, charToIx, storeDir):
+
+    """
+    Packs the visual features (.npy) and targets (.txt) of every sample listed in the given split files into one
+    feature store. Samples of the pretrain/preval lists are read from datadir/pretrain, all others from
+    datadir/main (see list_names); store names are those paths relative to datadir.
+    """
+
+    names = list()
+    lists = dict()
+    for dataset in datasets:
+        listNames = list_names(datadir, dataset)
+        lists[dataset] = names_digest(listNames)
+        names.extend(listNames)
+    names = list(dict.fromkeys(names))
+    os.makedirs(storeDir, exist_ok=True)
+
+    lengths, trgts, wordStarts, times = list(), list(), list(), list()
+    featureDim = None
+    with open(os.path.join(storeDir, FEATURES_FILE + ".tmp"), "wb") as f:
+        for i, name in enumerate(names):
+            inp = np.load(datadir + "/" + name + ".npy")
+            if featureDim is None:
+                featureDim = inp.shape[1]
+            elif inp.shape[1] != featureDim:
+                raise ValueError(f"{name}.npy has feature size {inp.shape[1]}, expected {featureDim}")
+            f.write(np.ascontiguousarray(inp, dtype=np.float16).tobytes())
+            lengths.append(len(inp))
+
+            trgt, wordTimes = parse_target_file(datadir + "/" + name + ".txt")
+            trgts.append(np.array([charToIx[char] for char in trgt], dtype=np.int16))
+            #start of word k = total length of the previous words plus their separating spaces
+            words = trgt.split(" ")
+            wordStarts.append(np.cumsum([0] + [len(word)+1 for word in words]).astype(np.int32))
+            times.append(wordTimes)
+            if (i+1) % 1000 == 0:
+                print(f"Packed {i+1}/{len(names)} samples")
+
+    def ragged(arrays, dtype, shape=(0,)):
+        counts = np.array([len(a) for a in arrays], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+        flat = np.concatenate(arrays).astype(dtype) if len(arrays) > 0 else np.zeros(shape, dtype=dtype)
+        return flat, offsets, counts
+
+    lengths = np.array(lengths, dtype=np.int64)
+    trgt, trgtOffsets, trgtLengths = ragged(trgts, np.int16)
+    wordStarts, wordOffsets, wordCounts = ragged(wordStarts, np.int32)
+    times, timeOffsets, timeCounts = ragged(times, np.float64, (0,2))
+    with open(os.path.join(storeDir, INDEX_FILE + ".tmp"), "wb") as f:
+        np.savez(f, names=np.array(names), lengths=lengths,
+                 offsets=np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64),
+                 trgt=trgt, trgtOffsets=trgtOffsets, trgtLengths=trgtLengths,
+                 wordStarts=wordStarts, wordOffsets=wordOffsets, wordCounts=wordCounts-1,
+                 times=times, timeOffsets=timeOffsets, timeCounts=timeCounts)
+    meta = {"featureDim": int(featureDim or 0), "dtype": "float16", "samples": len(names),
+            "frames": int(lengths.sum()), "charToIx": charToIx, "lists": lists}
+    with open(os.path.join(storeDir, META_FILE + ".tmp"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    for file in (FEATURES_FILE, INDEX_FILE, META_FILE):
+        os.replace(os.path.join(storeDir, file + ".tmp"), os.path.join(storeDir, file))
+    print(f"Packed {len(names)} samples ({int(lengths.sum())} frames) into {storeDir}")
+    return
+
+
+
+if __name__ == "__main__":
+    import sys
+    from lipreading.config import args
+    #split lists to pack, e.g. python -m lipreading.datasets.feature_store pretrain preval train val test
+    datasets = sys.argv[1:] if len(sys.argv) > 1 else ["train", "val", "test"]
+    pack_features(args["DATA_DIRECTORY"], datasets, args["CHAR_TO_INDEX"], args["FEATURE_STORE"])
@@ -4,6 +4,8 @@ import numpy as np
 
 from .utils import prepare_pretrain_input
 from .utils import prepare_main_input
+from .utils import prepare_pretrain_input_from_store
+from .utils import prepare_main_input_from_store
 
 
 
@@ -11,9 +13,10 @@ class LRS2Pretrain(Dataset):
 
     """
     A custom dataset class for the LRS2 pretrain (includes pretain, preval) dataset.
+    If a FeatureStore is given, samples are sliced out of it instead of being read from the .npy/.txt files.
     """
 
-    def __init__(self, dataset, datadir, numWords, charToIx, stepSize, videoParams):
+    def __init__(self, dataset, datadir, numWords, charToIx, stepSize, videoParams, store=None):
         super(LRS2Pretrain, self).__init__()
         with open(datadir + "/" + dataset + ".txt", "r") as f:
             lines = f.readlines()
@@ -23,6 +26,12 @@ class LRS2Pretrain(Dataset):
         self.dataset = dataset
         self.stepSize = stepSize
         self.videoParams = videoParams
+        self.store = store
+        if store is not None:
+            store.check_char_to_ix(charToIx)
+            self.storeIxs = [store.index("pretrain/" + line.strip()) for line in lines]
+            #word window distribution of each sample, computed on first use
+            self.windowProbs = dict()
         return
 
 
@@ -39,6 +48,10 @@ class LRS2Pretrain(Dataset):
             
             index = np.random.choice(ixs)
 
+        if self.store is not None:
+            return prepare_pretrain_input_from_store(self.store, self.storeIxs[index], self.numWords, self.charToIx,
+                                                     self.videoParams, self.windowProbs)
+
         #passing the visual features file and the target file paths to the prepare function to obtain the input tensors
         visualFeaturesFile = self.datalist[index] + ".npy"
         targetFile = self.datalist[index] + ".txt"
@@ -60,9 +73,12 @@ class LRS2Main(Dataset):
 
     """
     A custom dataset class for the LRS2 main (includes train, val, test) dataset
+    If a FeatureStore is given, samples are sliced out of it instead of being read from the .npy/.txt files.
+    With stepSampling=False the train set is indexed directly like val/test, for a batch sampler that draws the samples
+    of each step itself (see FrameBudgetBatchSampler).
     """
 
-    def __init__(self, dataset, datadir, reqInpLen, charToIx, stepSize, videoParams):
+    def __init__(self, dataset, datadir, reqInpLen, charToIx, stepSize, videoParams, store=None, stepSampling=True):
         super(LRS2Main, self).__init__()
         with open(datadir + "/" + dataset + ".txt", "r") as f:
             lines = f.readlines()
@@ -72,11 +88,27 @@ class LRS2Main(Dataset):
         self.dataset = dataset
         self.stepSize = stepSize
         self.videoParams = videoParams
+        self.store = store
+        self.stepSampling = stepSampling
+        if store is not None:
+            store.check_char_to_ix(charToIx)
+            self.storeIxs = [store.index("main/" + line.strip().split(" ")[0]) for line in lines]
         return
 
 
+    def lengths(self):
+        """
+        Input length of every sample after padding to reqInpLen, from the feature store or the .npy headers.
+        """
+        if self.store is not None:
+            lengths = self.store.lengths[self.storeIxs]
+        else:
+            lengths = np.array([np.load(file + ".npy", mmap_mode="r").shape[0] for file in self.datalist], dtype=np.int64)
+        return np.maximum(lengths, self.reqInpLen)
+
+
     def __getitem__(self, index):
-        if self.dataset == "train":
+        if self.dataset == "train" and self.stepSampling:
             base = self.stepSize * np.arange(int(len(self.datalist) / self.stepSize) + 1)
             ixs = base + index
             ixs = ixs[ixs < len(self.datalist)]
@@ -88,6 +120,10 @@ class LRS2Main(Dataset):
             
             index = np.random.choice(ixs)
 
+        if self.store is not None:
+            return prepare_main_input_from_store(self.store, self.storeIxs[index], self.reqInpLen, self.charToIx,
+                                                 self.videoParams)
+
         #passing the visual features file and the target file paths to the prepare function to obtain the input tensors
         visualFeaturesFile = self.datalist[index] + ".npy"
         targetFile = self.datalist[index] + ".txt"
@@ -99,7 +135,7 @@ class LRS2Main(Dataset):
         #using step size only for train dataset and not for val and test datasets because
         #the size of val and test datasets is smaller than step size and we generally want to validate and test
         #on the complete dataset
-        if self.dataset == "train":
+        if self.dataset == "train" and self.stepSampling:
             return self.stepSize
         else:
             return len(self.datalist)
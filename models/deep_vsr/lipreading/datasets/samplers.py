@@ -0,0 +1,80 @@
+import numpy as np
+from torch.utils.data import Sampler
+
+
+
+class FrameBudgetBatchSampler(Sampler):
+
+    """
+    A batch sampler that groups clips of similar length into batches whose padded size (number of clips x length of the
+    longest clip, which is what collate_fn allocates) stays within maxFrames, so the memory used by a step is bounded
+    whatever the clip lengths. maxBatchSize optionally caps the number of clips per batch.
+    Every iteration draws numSamples clips at random (all of them if numSamples is None), sorts them by length and fills
+    the batches greedily; the batch order is shuffled if shuffle is set. Without shuffle all clips are used in length
+    order, which is deterministic. A clip longer than maxFrames forms a batch of its own.
+    """
+
+    def __init__(self, lengths, maxFrames, maxBatchSize=None, numSamples=None, shuffle=True):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.maxFrames = maxFrames
+        self.maxBatchSize = maxBatchSize
+        self.numSamples = len(self.lengths) if numSamples is None else min(numSamples, len(self.lengths))
+        self.shuffle = shuffle
+        #batches of the next iteration once __len__ has been asked for them, and of the current/last iteration
+        self.pending = None
+        self.current = None
+        return
+
+
+    def make_batches(self):
+        if self.shuffle:
+            ixs = np.random.permutation(len(self.lengths))[:self.numSamples]
+        else:
+            ixs = np.arange(self.numSamples)
+        ixs = ixs[np.argsort(self.lengths[ixs], kind="stable")]
+
+        batches = list()
+        batch = list()
+        for ix in ixs:
+            #clips come in increasing length, so the new clip is the longest of the batch
+            full = (len(batch)+1)*self.lengths[ix] > self.maxFrames
+            if self.maxBatchSize is not None:
+                full = full or len(batch) == self.maxBatchSize
+            if len(batch) > 0 and full:
+                batches.append(batch)
+                batch = list()
+            batch.append(int(ix))
+        if len(batch) > 0:
+            batches.append(batch)
+
+        if self.shuffle:
+            batches = [batches[i] for i in np.random.permutation(len(batches))]
+        return batches
+
+
+    def __iter__(self):
+        if self.pending is None:
+            self.pending = self.make_batches()
+        self.current, self.pending = self.pending, None
+        return iter(self.current)
+
+
+    def __len__(self):
+        #the number of batches depends on the clips drawn, so it is that of the iteration in progress (or last
+        #finished), or else of the batches the next iteration will use
+        if self.current is not None:
+            return len(self.current)
+        if self.pending is None:
+            self.pending = self.make_batches()
+        return len(self.pending)
+
+
+    def padding_ratio(self, batches=None):
+        """
+        Fraction of the frames allocated by collate_fn that are padding, over the given (default: current) batches.
+        """
+        if batches is None:
+            batches = self.current if self.current is not None else self.make_batches()
+        padded = sum([len(batch)*self.lengths[batch].max() for batch in batches])
+        used = sum([self.lengths[batch].sum() for batch in batches])
+        return 1 - used/padded
@@ -35,12 +35,7 @@ def prepare_main_input(visualFeaturesFile, targetFile, reqInpLen, charToIx, vide
 
     #checking whether the input length is greater than or equal to the required length
     #if not, extending the input by padding zero vectors
-    inpLen = len(inp)
-    if inpLen < reqInpLen:
-        leftPadding = int(np.floor((reqInpLen - inpLen)/2))
-        rightPadding = int(np.ceil((reqInpLen - inpLen)/2))
-        inp = np.pad(inp, ((leftPadding,rightPadding),(0,0)), "constant")
-
+    inp = pad_input(inp, reqInpLen)
     inpLen = len(inp)
 
 
@@ -104,25 +99,118 @@ def prepare_pretrain_input(visualFeaturesFile, targetFile, numWords, charToIx, v
 
     #checking whether the input length is greater than or equal to the required length
     #if not, extending the input by padding zero vectors
+    inp = pad_input(inp, req_input_length(trgt))
     inpLen = len(inp)
-    reqInpLen = req_input_length(trgt)
-    if inpLen < reqInpLen:
-        leftPadding = int(np.floor((reqInpLen - inpLen)/2))
-        rightPadding = int(np.ceil((reqInpLen - inpLen)/2))
-        inp = np.pad(inp, ((leftPadding,rightPadding),(0,0)), "constant")
 
-    inpLen = len(inp)
+
+    inp = torch.from_numpy(inp)
+    inpLen = torch.tensor(inpLen)
+    trgt = torch.from_numpy(trgt)
+    trgtLen = torch.tensor(trgtLen)
+
+    return inp, trgt, inpLen, trgtLen
 
 
+
+def prepare_main_input_from_store(store, index, reqInpLen, charToIx, videoParams):
+
+    """
+    Same as prepare_main_input, for sample number index of a FeatureStore: the features and the pre-encoded target
+    are sliced straight out of the store instead of reading the .npy and .txt files.
+    """
+
+    trgt = np.append(store.target(index), charToIx["<EOS>"])
+    trgtLen = len(trgt)
+
+    #the target length must be less than or equal to 100 characters (restricted space where our model will work)
+    if trgtLen > 100:
+        print("Target length more than 100 characters. Exiting")
+        exit()
+
+    inp = pad_input(store.feats(index), reqInpLen)
+    inpLen = len(inp)
+
     inp = torch.from_numpy(inp)
     inpLen = torch.tensor(inpLen)
     trgt = torch.from_numpy(trgt)
     trgtLen = torch.tensor(trgtLen)
+    return inp, trgt, inpLen, trgtLen
+
+
+
+def word_window_probs(wordStarts, numWords):
+
+    """
+    Softmax distribution over the numWords-word windows of a target, given its word start positions (as stored in a
+    FeatureStore). Window i spans wordStarts[i] to wordStarts[i+numWords]-1, so its length plus one is the difference.
+    """
 
+    nWordLens = (wordStarts[numWords:] - wordStarts[:-numWords]).astype(np.float64)
+    return softmax(nWordLens)
+
+
+
+def prepare_pretrain_input_from_store(store, index, numWords, charToIx, videoParams, windowProbs=None):
+
+    """
+    Same as prepare_pretrain_input, for sample number index of a FeatureStore. Only the feature rows of the chosen
+    word window are read. windowProbs, if given, is a dict caching the window distribution of each sample.
+    """
+
+    wordStarts = store.word_starts(index)
+
+    #if number of words in target is less than the required number of words, consider the whole target
+    if len(wordStarts) - 1 <= numWords:
+        trgt = store.target(index)
+        inp = store.feats(index)
+
+    else:
+        #choose the word window according to a softmax distribution of the lengths (see prepare_pretrain_input)
+        if windowProbs is None:
+            probs = word_window_probs(wordStarts, numWords)
+        else:
+            if index not in windowProbs:
+                windowProbs[index] = word_window_probs(wordStarts, numWords)
+            probs = windowProbs[index]
+        ix = np.random.choice(np.arange(len(probs)), p=probs)
+        trgt = store.target(index, wordStarts[ix], wordStarts[ix+numWords]-1)
+
+        #slicing the visual features between the start and end times of the selected window
+        times = store.word_times(index)
+        videoFPS = videoParams["videoFPS"]
+        videoStartTime = times[ix][0]
+        videoEndTime = times[ix+numWords-1][1]
+        inp = store.feats(index, int(np.floor(videoFPS*videoStartTime)), int(np.ceil(videoFPS*videoEndTime)))
+
+    trgt = np.append(trgt, charToIx["<EOS>"])
+    trgtLen = len(trgt)
+
+    inp = pad_input(inp, req_input_length(trgt))
+    inpLen = len(inp)
+
+    inp = torch.from_numpy(inp)
+    inpLen = torch.tensor(inpLen)
+    trgt = torch.from_numpy(trgt)
+    trgtLen = torch.tensor(trgtLen)
     return inp, trgt, inpLen, trgtLen
 
 
 
+def pad_input(inp, reqInpLen):
+
+    """
+    Extends the input to the required length by padding zero vectors equally on both sides, if it is shorter.
+    """
+
+    inpLen = len(inp)
+    if inpLen < reqInpLen:
+        leftPadding = int(np.floor((reqInpLen - inpLen)/2))
+        rightPadding = int(np.ceil((reqInpLen - inpLen)/2))
+        inp = np.pad(inp, ((leftPadding,rightPadding),(0,0)), "constant")
+    return inp
+
+
+
 def collate_fn(dataBatch):
     """
     Collate function definition used in Dataloaders.
@@ -1,3 +1,4 @@
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
@@ -106,3 +107,29 @@ class VisualFrontend(nn.Module):
         outputBatch = outputBatch.transpose(1 ,2)
         outputBatch = outputBatch.transpose(1, 2).transpose(0, 1)
         return outputBatch
+
+
+    def forward_clips(self, clips):
+
+        """
+        Runs the frontend over several clips in one forward pass. clips is a list of (T_i, 1, 1, H, W) input tensors.
+        They are concatenated along time with as many zero frames in between as the temporal padding of the 3D
+        convolution, so no output frame sees a frame of another clip and each clip gets exactly the features it would
+        get on its own. Returns the list of (T_i, 1, 512) outputs.
+        """
+
+        gap = self.frontend3D[0].padding[0]
+        zeros = clips[0].new_zeros((gap,) + tuple(clips[0].shape[1:]))
+        parts = list()
+        for i, clip in enumerate(clips):
+            if i > 0:
+                parts.append(zeros)
+            parts.append(clip)
+        outputBatch = self.forward(torch.cat(parts, dim=0))
+
+        outputs = list()
+        start = 0
+        for clip in clips:
+            outputs.append(outputBatch[start:start+len(clip)])
+            start = start + len(clip) + gap
+        return outputs
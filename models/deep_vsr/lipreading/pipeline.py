@@ -7,6 +7,7 @@ from lipreading.data_processing.data_converter import CSVToTXTConverter
 from lipreading.data_processing.label_video_splitter import LabelVideoSplitter
 from lipreading.data_processing.split_files_creator import SplitFilesCreator
 from lipreading.data_processing.data_preprocessor import DataPreprocessor
+from lipreading.datasets.feature_store import pack_features, list_names
 from lipreading.training.model_trainer import ModelTrainer
 
 def main_pipeline():
@@ -33,6 +34,19 @@ def main_pipeline():
     preprocessor = DataPreprocessor()
     preprocessor.preprocess_data()
 
+    # Pack the preprocessed features and targets into one memory-mapped store read by the datasets; the pretrain/preval
+    # lists are packed too when their samples have been preprocessed
+    if args["FEATURE_STORE"]:
+        print("\n=== Packing Features into the Feature Store ===")
+        datasets = ["train", "val", "test"]
+        for dataset in ["pretrain", "preval"]:
+            names = list_names(args["DATA_DIRECTORY"], dataset)
+            if all(os.path.exists(os.path.join(args["DATA_DIRECTORY"], name + ".npy")) for name in names):
+                datasets.append(dataset)
+            else:
+                print(f"Not packing the {dataset} list: some of its samples have no features")
+        pack_features(args["DATA_DIRECTORY"], datasets, args["CHAR_TO_INDEX"], args["FEATURE_STORE"])
+
     # Step 5: Train the Model with Curriculum Learning
     print("\n=== Step 5: Training the Model with Curriculum Learning ===")
     trainer = ModelTrainer()
@@ -15,6 +15,8 @@ import numpy as np
 from lipreading.config import args
 from lipreading.models.video_net import VideoNet
 from lipreading.datasets.lrs2_dataset import LRS2Main
+from lipreading.datasets.feature_store import FeatureStore
+from lipreading.datasets.samplers import FrameBudgetBatchSampler
 from lipreading.datasets.utils import collate_fn
 from lipreading.utils.general import num_params, train, evaluate
 
@@ -62,39 +64,18 @@ class ModelTrainer:
     def train_model(self):
         """
         Trains the VideoNet model using curriculum learning.
-        Iterates over predefined word counts and adjusts batch size upon OOM errors.
+        Iterates over predefined word counts; batches are formed under a frame budget, so no iteration has to be
+        restarted with a smaller batch.
         """
         curriculum_word_counts = [1, 2, 3, 5, 7, 9, 13, 17, 21, 29, 37]
-        initial_batch_size = args["BATCH_SIZE"]
 
         for word_count in curriculum_word_counts:
             print(f"\n=== Starting Curriculum Learning Iteration with {word_count} words ===")
             args["PRETRAIN_NUM_WORDS"] = word_count  # Update the number of words in config
-            batch_size = initial_batch_size
-            oom_encountered = False
+            self._train_iteration(word_count)
+            print(f"Completed iteration with {word_count} words.")
 
-            while True:
-                try:
-                    self._train_iteration(batch_size, word_count)
-                    break  # Break the loop if training completes without OOM
-                except RuntimeError as e:
-                    if 'out of memory' in str(e).lower():
-                        print(f"Out Of Memory error encountered with batch size {batch_size}. Reducing batch size by half.")
-                        torch.cuda.empty_cache()
-                        batch_size = max(1, batch_size // 2)
-                        oom_encountered = True
-                        if batch_size == 1:
-                            print("Minimum batch size reached. Cannot reduce further.")
-                            break
-                    else:
-                        raise e
-
-            if oom_encountered:
-                print(f"Completed iteration with adjusted batch size {batch_size} due to OOM errors.")
-            else:
-                print(f"Completed iteration with batch size {batch_size}.")
-
-    def _train_iteration(self, batch_size, word_count):
+    def _train_iteration(self, word_count):
         """
         Trains the model for a single curriculum learning iteration.
         Implements early stopping based on validation WER flattening and learning rate schedule.
@@ -111,6 +92,19 @@ class ModelTrainer:
 
         # Load datasets with the specified number of words
         video_params = {"videoFPS": args["VIDEO_FPS"]}
+        store = None
+        if args["FEATURE_STORE"]:
+            if os.path.exists(os.path.join(args["FEATURE_STORE"], "index.npz")):
+                store = FeatureStore(args["FEATURE_STORE"])
+                reason = store.stale_reason(data_directory, ["train", "val"])
+                if reason is not None:
+                    print(f"Not using feature store {args['FEATURE_STORE']}: {reason}. Reading per-sample files.")
+                    store = None
+                else:
+                    print(f"Reading samples from feature store {args['FEATURE_STORE']}")
+            else:
+                print(f"No feature store at {args['FEATURE_STORE']}. Reading per-sample files.")
+        max_frames = args["MAX_BATCH_FRAMES"]
         train_data = LRS2Main(
             "train",
             data_directory,
@@ -118,13 +112,21 @@ class ModelTrainer:
             args["CHAR_TO_INDEX"],
             args["STEP_SIZE"],
             video_params,
-            num_words=word_count  # Pass the number of words for curriculum learning
+            store=store,
+            stepSampling=False  # The sampler draws STEP_SIZE samples per step
+        )
+        # Each step draws STEP_SIZE samples and batches them by length under the frame budget
+        train_sampler = FrameBudgetBatchSampler(
+            train_data.lengths(),
+            max_frames,
+            maxBatchSize=args["BATCH_SIZE"],
+            numSamples=args["STEP_SIZE"],
+            shuffle=True
         )
         train_loader = DataLoader(
             train_data,
-            batch_size=batch_size,
+            batch_sampler=train_sampler,
             collate_fn=collate_fn,
-            shuffle=True,
             **kwargs
         )
         val_data = LRS2Main(
@@ -134,13 +136,18 @@ class ModelTrainer:
             args["CHAR_TO_INDEX"],
             args["STEP_SIZE"],
             video_params,
-            num_words=word_count  # Ensure validation data matches the training data
+            store=store
+        )
+        val_sampler = FrameBudgetBatchSampler(
+            val_data.lengths(),
+            max_frames,
+            maxBatchSize=args["BATCH_SIZE"],
+            shuffle=False
         )
         val_loader = DataLoader(
             val_data,
-            batch_size=batch_size,
+            batch_sampler=val_sampler,
             collate_fn=collate_fn,
-            shuffle=False,
             **kwargs
         )
 
@@ -184,7 +191,7 @@ class ModelTrainer:
         best_val_wer = float('inf')
         lr_reached_min = False
 
-        print(f"\nStarting training with batch size {batch_size} and {word_count} words per sample.")
+        print(f"\nStarting training with at most {max_frames} frames ({args['BATCH_SIZE']} clips) per batch and {word_count} words per sample.")
 
         train_params = {
             "spaceIx": args["CHAR_TO_INDEX"].get(" ", 1),
@@ -208,6 +215,7 @@ class ModelTrainer:
             )
             training_loss_curve.append(training_loss)
             training_wer_curve.append(training_wer)
+            train_padding = train_sampler.padding_ratio()
 
             # Evaluate the model on validation set
             validation_loss, validation_cer, validation_wer = evaluate(
@@ -223,7 +231,8 @@ class ModelTrainer:
             # Printing the stats after each step
             print(f"Step: {step+1:04d}/{args['NUM_STEPS']} || Tr.Loss: {training_loss:.6f}  Val.Loss: {validation_loss:.6f} || "
                   f"Tr.CER: {training_cer:.3f}  Val.CER: {validation_cer:.3f} || "
-                  f"Tr.WER: {training_wer:.3f}  Val.WER: {validation_wer:.3f}")
+                  f"Tr.WER: {training_wer:.3f}  Val.WER: {validation_wer:.3f} || "
+                  f"Tr.Batches: {len(train_sampler)}  Tr.Padding: {train_padding:.3f}")
 
             # Check for early stopping based on validation WER flattening
             if validation_wer + min_delta < best_val_wer:
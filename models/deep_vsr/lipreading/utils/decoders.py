@@ -45,99 +45,133 @@ def ctc_greedy_decode(outputBatch, inputLenBatch, eosIx, blank=0):
 
 
 
-class BeamEntry:
-    """
-    Class for a single entry in the beam.
-    """
-    def __init__(self):
-        self.logPrTotal = -np.inf
-        self.logPrNonBlank = -np.inf
-        self.logPrBlank = -np.inf
-        self.logPrText = 0
-        self.lmApplied = False
-        self.lmState = None
-        self.labeling = tuple()
-
-
-
-class BeamState:
+class PrefixTrie:
 
     """
-    Class for the beam.
+    Parent-pointer table of all prefixes seen during a beam search. Each prefix is an integer node id (0 is the empty
+    prefix), so extending a prefix never copies it. Child lookups go through a sorted (parent*numChars + char) key
+    array, which keeps node ids canonical: the same prefix always maps to the same node.
     """
 
-    def __init__(self, alpha, beta):
-        self.entries = dict()
-        self.alpha = alpha
-        self.beta = beta
+    def __init__(self, numChars):
+        self.numChars = numChars
+        self.parent = np.full(1024, -1, dtype=np.int64)
+        self.char = np.full(1024, -1, dtype=np.int64)
+        self.depth = np.zeros(1024, dtype=np.int64)
+        self.size = 1
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.vals = np.zeros(0, dtype=np.int64)
 
 
-    def score(self, entry):
+    def children(self, nodes, chars):
         """
-        Function to compute score of each entry in the beam.
+        Node ids of the given (parent node, char) extensions, creating the missing ones. Returns the ids and a mask
+        of the extensions that were created by this call.
         """
-        labelingLen = len(entry.labeling)
-        if labelingLen == 0:
-            score = entry.logPrTotal + self.alpha*entry.logPrText
-        else:
-            score = (entry.logPrTotal + self.alpha*entry.logPrText)/(labelingLen**self.beta)
-        return score
-
-
-    def sort(self):
+        query = nodes*self.numChars + chars
+        pos = np.searchsorted(self.keys, query)
+        found = np.zeros(len(query), dtype=bool)
+        inRange = pos < len(self.keys)
+        found[inRange] = self.keys[pos[inRange]] == query[inRange]
+        ids = np.empty(len(query), dtype=np.int64)
+        ids[found] = self.vals[pos[found]]
+
+        newKeys, first = np.unique(query[~found], return_index=True)
+        newIds = self.size + np.arange(len(newKeys))
+        self._grow(self.size + len(newKeys))
+        newIx = np.flatnonzero(~found)[first]
+        self.parent[newIds] = nodes[newIx]
+        self.char[newIds] = chars[newIx]
+        self.depth[newIds] = self.depth[nodes[newIx]] + 1
+        self.size += len(newKeys)
+
+        at = np.searchsorted(self.keys, newKeys)
+        self.keys = np.insert(self.keys, at, newKeys)
+        self.vals = np.insert(self.vals, at, newIds)
+        ids[~found] = newIds[np.searchsorted(newKeys, query[~found])]
+        return ids, ~found
+
+
+    def _grow(self, size):
+        if size > len(self.parent):
+            capacity = max(size, 2*len(self.parent))
+            for name, fill in (("parent", -1), ("char", -1), ("depth", 0)):
+                old = getattr(self, name)
+                arr = np.full(capacity, fill, dtype=np.int64)
+                arr[:len(old)] = old
+                setattr(self, name, arr)
+        return
+
+
+    def labeling(self, node):
         """
-        Function to sort all the beam entries in descending order depending on their scores.
+        Character indices of the prefix ending at the given node.
         """
-        beams = [entry for (key, entry) in self.entries.items()]
-        sortedBeams = sorted(beams, reverse=True, key=self.score)
-        return [x.labeling for x in sortedBeams]
+        labeling = list()
+        while node > 0:
+            labeling.append(int(self.char[node]))
+            node = self.parent[node]
+        return labeling[::-1]
 
 
 
-def apply_lm(parentBeam, childBeam, spaceIx, lm):
+def lm_step(lm, inputIxs, initState, device):
 
     """
-    Applying the language model to obtain the language model character probabilities at a time step
-    given all the previous characters.
+    Runs the character LM for one step over a batch of prefixes. Returns the log-probability distributions over the
+    next character (one row per prefix) and the LM state after consuming the input characters.
     """
 
-    if not (childBeam.lmApplied):
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        if parentBeam.lmState == None:
-            initStateBatch = None
-            inputBatch = torch.tensor(spaceIx-1).reshape(1,1)
-            inputBatch = inputBatch.to(device)
-        else:
-            initStateBatch = parentBeam.lmState
-            inputBatch = torch.tensor(parentBeam.labeling[-1]-1).reshape(1,1)
-            inputBatch = inputBatch.to(device)
-        lm.eval()
-        with torch.no_grad():
-            outputBatch, finalStateBatch = lm(inputBatch, initStateBatch)
-        logProbs = outputBatch.squeeze()
-        logProb = logProbs[childBeam.labeling[-1]-1]
-        childBeam.logPrText = parentBeam.logPrText + logProb
-        childBeam.lmApplied = True
-        childBeam.lmState = finalStateBatch
-    return
+    inputBatch = torch.as_tensor(np.asarray(inputIxs)).reshape(1,-1).to(device)
+    with torch.no_grad():
+        outputBatch, finalStateBatch = lm(inputBatch, initState)
+    return outputBatch[0].cpu().numpy().astype(np.float64), finalStateBatch
+
 
 
+def apply_lm(trie, nodes, lmText, lmCache, spaceIx, lm, device):
 
-def add_beam(beamState, labeling):
     """
-    Function to add a new entry to the beam.
+    Sets the language model score of newly created prefixes: text score of the parent plus the LM log-probability of
+    the last character given the parent.
+    lmCache maps a prefix node to (distribution over its next character, LM state after it) and is shared across
+    time steps. All parents missing from it are run through the LM in one batched call over their stacked parent
+    states (the empty prefix starts from the space character); each parent's distribution then serves all of its
+    children.
     """
-    if labeling not in beamState.entries.keys():
-        beamState.entries[labeling] = BeamEntry()
+
+    parents = trie.parent[nodes]
+    todo = [p for p in np.unique(parents) if p not in lmCache]
+    if 0 in todo:
+        dists, state = lm_step(lm, [spaceIx-1], None, device)
+        lmCache[0] = (dists[0], state)
+        todo.remove(0)
+    if len(todo) > 0:
+        grand = [lmCache[trie.parent[p]][1] for p in todo]
+        initState = (torch.cat([h for (h, c) in grand], dim=1), torch.cat([c for (h, c) in grand], dim=1))
+        dists, (h, c) = lm_step(lm, trie.char[todo]-1, initState, device)
+        for i, p in enumerate(todo):
+            lmCache[p] = (dists[i], (h[:,i:i+1], c[:,i:i+1]))
+    dists = np.stack([lmCache[p][0] for p in parents])
+    lmText[nodes] = lmText[parents] + dists[np.arange(len(nodes)), trie.char[nodes]-1]
+    return
 
 
 
-def log_add(a, b):
+def select_beams(score, first, beamWidth):
+
     """
-    Addition of log probabilities.
+    Indices of the beamWidth best entries, in descending order of score. Ties are broken by the order in which the
+    entries were added, as a stable sort would do.
     """
-    result = np.log(np.exp(a) + np.exp(b))
-    return result
+
+    if len(score) > beamWidth:
+        kth = np.argpartition(-score, beamWidth-1)[beamWidth-1]
+        cand = np.flatnonzero(score >= score[kth])
+    else:
+        cand = np.arange(len(score))
+    order = np.lexsort((first[cand], -score[cand]))
+    return cand[order[:beamWidth]]
 
 
 
@@ -148,11 +182,13 @@ def ctc_search_decode(outputBatch, inputLenBatch, beamSearchParams, spaceIx, eos
     Note: The probability assigned to <EOS> token is added to the probability of the blank token before decoding
     to avoid <EOS> predictions in middle of transcriptions. Once decoded, <EOS> token is appended at last to the
     predictions for uniformity with targets.
+    The beam lives in NumPy arrays indexed by prefix node ids of a PrefixTrie; log-probabilities are combined with
+    np.logaddexp and the best beams are picked with argpartition.
     """
 
     outputBatch = outputBatch.cpu()
     inputLenBatch = inputLenBatch.cpu()
-    outputBatch[:,:,blank] = torch.log(torch.exp(outputBatch[:,:,blank]) + torch.exp(outputBatch[:,:,eosIx]))
+    outputBatch[:,:,blank] = torch.logaddexp(outputBatch[:,:,blank], outputBatch[:,:,eosIx])
     reqIxs = np.arange(outputBatch.shape[2])
     reqIxs = reqIxs[reqIxs != eosIx]
     outputBatch = outputBatch[:,:,reqIxs]
@@ -162,7 +198,11 @@ def ctc_search_decode(outputBatch, inputLenBatch, beamSearchParams, spaceIx, eos
     beta = beamSearchParams["beta"]
     threshProb = beamSearchParams["threshProb"]
 
-    outLogProbs = outputBatch.transpose(0, 1).numpy()
+    if lm is not None:
+        lm.eval()
+        device = next(lm.parameters()).device
+
+    outLogProbs = outputBatch.transpose(0, 1).numpy().astype(np.float64)
     inpLens = inputLenBatch.numpy()
     preds = list()
     predLens = list()
@@ -174,74 +214,65 @@ def ctc_search_decode(outputBatch, inputLenBatch, beamSearchParams, spaceIx, eos
         maxT, maxC = mat.shape
 
         #initializing the main beam with a single entry having empty prediction
-        last = BeamState(alpha, beta)
-        labeling = tuple()
-        last.entries[labeling] = BeamEntry()
-        last.entries[labeling].logPrBlank = 0
-        last.entries[labeling].logPrTotal = 0
+        trie = PrefixTrie(maxC)
+        lmText = np.zeros(1024)
+        lmCache = dict()
+        nodes = np.zeros(1, dtype=np.int64)
+        logPrBlank = np.zeros(1)
+        logPrNonBlank = np.full(1, -np.inf)
+        logPrTotal = np.zeros(1)
 
         #going over all the time steps
         for t in range(maxT):
 
-            #a temporary beam to store all possible predictions (which are extensions of predictions
-            #in the main beam after time step t-1) after time step t
-            curr = BeamState(alpha, beta)
             #considering only the characters with probability above a certain threshold to speeden up the algo
             prunedChars = np.where(mat[t,:] > np.log(threshProb))[0]
+            prunedChars = prunedChars[prunedChars != blank]
+            numBeams, numExt = len(nodes), len(prunedChars)
+            lastChars = trie.char[nodes]
+
+            #same prediction (either blank or last character repeated)
+            sameNonBlank = np.where(lastChars >= 0, logPrNonBlank + mat[t, lastChars], -np.inf)
+            sameBlank = logPrTotal + mat[t, blank]
+
+            #extending every beam with all characters in the pruned set
+            parentIx = np.repeat(np.arange(numBeams), numExt)
+            extChars = np.tile(prunedChars, numBeams)
+            extNonBlank = mat[t, extChars] + np.where(lastChars[parentIx] == extChars, logPrBlank[parentIx],
+                                                      logPrTotal[parentIx])
+            extNodes, created = trie.children(nodes[parentIx], extChars)
+
+            #applying language model
+            if lm is not None and created.any():
+                if trie.size > len(lmText):
+                    lmText = np.concatenate([lmText, np.zeros(len(trie.parent) - len(lmText))])
+                apply_lm(trie, extNodes[created], lmText, lmCache, spaceIx, lm, device)
+
+            #merging extensions that coincide with an existing beam; the order of first appearance
+            #(beam by beam, each beam followed by its extensions) breaks ties between equal scores
+            allNodes = np.concatenate([nodes, extNodes])
+            order = np.concatenate([np.arange(numBeams)*(numExt+1),
+                                    parentIx*(numExt+1) + 1 + np.tile(np.arange(numExt), numBeams)])
+            uniq, inv = np.unique(allNodes, return_inverse=True)
+            newBlank = np.full(len(uniq), -np.inf)
+            newNonBlank = np.full(len(uniq), -np.inf)
+            newBlank[inv[:numBeams]] = sameBlank
+            newNonBlank[inv[:numBeams]] = sameNonBlank
+            newNonBlank[inv[numBeams:]] = np.logaddexp(newNonBlank[inv[numBeams:]], extNonBlank)
+            newTotal = np.logaddexp(newBlank, newNonBlank)
+            first = np.full(len(uniq), len(allNodes))
+            np.minimum.at(first, inv, order)
 
             #keeping only the best predictions in the main beam
-            bestLabelings = last.sort()[:beamWidth]
-
-            #going over all the best predictions
-            for labeling in bestLabelings:
-
-                #same prediction (either blank or last character repeated)
-                if len(labeling) != 0:
-                    logPrNonBlank = last.entries[labeling].logPrNonBlank + mat[t, labeling[-1]]
-                else:
-                    logPrNonBlank = -np.inf
-
-                logPrBlank = last.entries[labeling].logPrTotal + mat[t, blank]
-
-                add_beam(curr, labeling)
-                curr.entries[labeling].labeling = labeling
-                curr.entries[labeling].logPrNonBlank = log_add(curr.entries[labeling].logPrNonBlank, logPrNonBlank)
-                curr.entries[labeling].logPrBlank = log_add(curr.entries[labeling].logPrBlank, logPrBlank)
-                curr.entries[labeling].logPrTotal = log_add(curr.entries[labeling].logPrTotal, log_add(logPrBlank, logPrNonBlank))
-                curr.entries[labeling].logPrText = last.entries[labeling].logPrText
-                curr.entries[labeling].lmApplied = True
-                curr.entries[labeling].lmState = last.entries[labeling].lmState
-
-
-                #extending the best prediction with all characters in the pruned set
-                for c in prunedChars:
-
-                    if c == blank:
-                        continue
-
-                    #extended prediction
-                    newLabeling = labeling + (c,)
-
-                    if (len(labeling) != 0)  and (labeling[-1] == c):
-                        logPrNonBlank = mat[t, c] + last.entries[labeling].logPrBlank
-                    else:
-                        logPrNonBlank = mat[t, c] + last.entries[labeling].logPrTotal
-
-                    add_beam(curr, newLabeling)
-                    curr.entries[newLabeling].labeling = newLabeling
-                    curr.entries[newLabeling].logPrNonBlank = log_add(curr.entries[newLabeling].logPrNonBlank, logPrNonBlank)
-                    curr.entries[newLabeling].logPrTotal = log_add(curr.entries[newLabeling].logPrTotal, logPrNonBlank)
-
-                    #applying language model
-                    if lm is not None:
-                        apply_lm(curr.entries[labeling], curr.entries[newLabeling], spaceIx, lm)
-
-            #replacing the main beam with the temporary beam having extended predictions
-            last = curr
+            depth = trie.depth[uniq]
+            score = newTotal + alpha*lmText[uniq] if lm is not None else newTotal
+            score = np.where(depth > 0, score/np.maximum(depth, 1)**beta, score)
+            best = select_beams(score, first, beamWidth)
+            nodes = uniq[best]
+            logPrBlank, logPrNonBlank, logPrTotal = newBlank[best], newNonBlank[best], newTotal[best]
 
         #output the best prediciton
-        bestLabeling = last.sort()[0]
-        bestLabeling = list(bestLabeling)
+        bestLabeling = trie.labeling(nodes[0])
         bestLabeling.append(eosIx)
         preds.extend(bestLabeling)
         predLens.append(len(bestLabeling))
@@ -2,6 +2,120 @@ import cv2 as cv
 import numpy as np
 import torch
 import os
+import queue
+import threading
+
+
+
+def load_roi_sequence(videoFile, roiSize):
+
+    """
+    Function to decode a video and crop the lip region of every frame. Each frame is converted to greyscale, resized to
+    224x224 and its central roiSize x roiSize region is kept. Returns a uint8 array of shape (T, roiSize, roiSize).
+    """
+
+    lo = int(112-(roiSize/2))
+    hi = int(112+(roiSize/2))
+    captureObj = cv.VideoCapture(videoFile)
+    roiSequence = list()
+    while (captureObj.isOpened()):
+        ret, frame = captureObj.read()
+        if ret == True:
+            grayed = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+            grayed = cv.resize(grayed, (224,224))
+            roiSequence.append(grayed[lo:hi, lo:hi])
+        else:
+            break
+    captureObj.release()
+    if len(roiSequence) == 0:
+        return np.zeros((0, roiSize, roiSize), dtype=np.uint8)
+    return np.stack(roiSequence, axis=0)
+
+
+
+def iterate_roi_sequences(files, roiSize, numWorkers, queueSize):
+
+    """
+    Generator over (file, roiSequence) pairs in completion order. numWorkers threads decode and crop the videos
+    (file + ".mp4") and feed a queue holding at most queueSize clips, so decoding overlaps with whatever the consumer
+    does and memory stays bounded. An error in a worker is raised in the consumer.
+    """
+
+    taskQueue = queue.Queue()
+    for file in files:
+        taskQueue.put(file)
+    roiQueue = queue.Queue(maxsize=queueSize)
+    numWorkers = max(1, min(numWorkers, len(files)))
+
+    def worker():
+        while True:
+            try:
+                file = taskQueue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                roiQueue.put((file, load_roi_sequence(file + ".mp4", roiSize)))
+            except Exception as e:
+                roiQueue.put((file, e))
+        roiQueue.put(None)
+        return
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(numWorkers)]
+    for thread in threads:
+        thread.start()
+    done = 0
+    while done < numWorkers:
+        item = roiQueue.get()
+        if item is None:
+            done = done + 1
+        elif isinstance(item[1], Exception):
+            raise RuntimeError(f"Failed to decode {item[0]}.mp4") from item[1]
+        else:
+            yield item
+    return
+
+
+
+def save_roi_montage(roiFile, roiSequence):
+
+    """
+    Writes the lip regions of all frames side by side into one greyscale image.
+    """
+
+    cv.imwrite(roiFile, np.concatenate(list(roiSequence), axis=1))
+    return
+
+
+
+def extract_visual_features(vf, roiSequences, normMean, normStd, device):
+
+    """
+    Function to normalise the lip regions of several clips and extract the visual features of all of them in a single
+    forward pass of the visual frontend. roiSequences is a list of uint8 (T, H, W) arrays; returns a list of float32
+    (T, 512) arrays. The frontend must already be in eval mode.
+    """
+
+    inputs = list()
+    for roiSequence in roiSequences:
+        inp = torch.from_numpy(roiSequence).to(device)
+        inp = (inp.float()/255 - normMean)/normStd
+        inputs.append(inp.reshape(inp.shape[0], 1, 1, inp.shape[1], inp.shape[2]))
+    with torch.no_grad():
+        outputs = vf.forward_clips(inputs)
+    return [torch.squeeze(out, dim=1).cpu().numpy() for out in outputs]
+
+
+
+def save_features(visualFeaturesFile, features):
+
+    """
+    Saves the features through a temporary file so an interrupted run never leaves a partial .npy behind.
+    """
+
+    with open(visualFeaturesFile + ".tmp", "wb") as f:
+        np.save(f, features)
+    os.replace(visualFeaturesFile + ".tmp", visualFeaturesFile)
+    return
 
 
 
@@ -23,33 +137,14 @@ def preprocess_sample(file, params):
 
 
     #for each frame, resize to 224x224 and crop the central 112x112 region
-    captureObj = cv.VideoCapture(videoFile)
-    roiSequence = list()
-    while (captureObj.isOpened()):
-        ret, frame = captureObj.read()
-        if ret == True:
-            grayed = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
-            grayed = grayed/255
-            grayed = cv.resize(grayed, (224,224))
-            roi = grayed[int(112-(roiSize/2)):int(112+(roiSize/2)), int(112-(roiSize/2)):int(112+(roiSize/2))]
-            roiSequence.append(roi)
-        else:
-            break
-    captureObj.release()
-    cv.imwrite(roiFile, np.floor(255*np.concatenate(roiSequence, axis=1)).astype(int))
+    roiSequence = load_roi_sequence(videoFile, roiSize)
+    if params.get("saveRoi", True):
+        save_roi_montage(roiFile, roiSequence)
 
 
     #normalise the frames and extract features for each frame using the visual frontend
     #save the visual features to a .npy file
-    inp = np.stack(roiSequence, axis=0)
-    inp = np.expand_dims(inp, axis=[1,2])
-    inp = (inp - normMean)/normStd
-    inputBatch = torch.from_numpy(inp)
-    inputBatch = (inputBatch.float()).to(device)
     vf.eval()
-    with torch.no_grad():
-        outputBatch = vf(inputBatch)
-    out = torch.squeeze(outputBatch, dim=1)
-    out = out.cpu().numpy()
-    np.save(visualFeaturesFile, out)
+    out = extract_visual_features(vf, [roiSequence], normMean, normStd, device)[0]
+    save_features(visualFeaturesFile, out)
     return
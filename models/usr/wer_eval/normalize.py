@@ -1,15 +1,28 @@
 import re
 import unicodedata
+from functools import lru_cache
 
 _PUNCT = r"[\.,;:!?…\"']"
-_SPACE = re.compile(r"\s+")
+_PUNCT_RE = re.compile(_PUNCT)
+
+@lru_cache(maxsize=1 << 16)
+def _normalize(s: str) -> str:
+    # str.split()/join collapses and strips exactly what \s+ / strip() would (same
+    # Unicode whitespace predicate); str.translate is slower than the compiled class
+    # for non-Latin-1 text, so punctuation still goes through one precompiled regex
+    return " ".join(_PUNCT_RE.sub("", unicodedata.normalize("NFC", s).lower()).split())
 
 def normalize_text(s: str) -> str:
     if s is None:
         return ""
-    s = str(s)
-    s = unicodedata.normalize("NFC", s)
-    s = s.lower()
-    s = re.sub(_PUNCT, "", s)
-    s = _SPACE.sub(" ", s).strip()
-    return s
+    return _normalize(str(s))
+
+def normalize_batch(texts):
+    """normalize_text over a list or column; repeated strings are normalized once."""
+    memo = {}
+    out = []
+    for t in texts:
+        if t not in memo:
+            memo[t] = normalize_text(t)
+        out.append(memo[t])
+    return out
@@ -1,70 +1,239 @@
-import argparse, json, itertools, os, tempfile, subprocess
+import argparse, csv, json, time
+from multiprocessing import Pool
 import numpy as np
-from jiwer import wer
 from .normalize import normalize_text
+from .edit_distance import word_errors
+from .logprob_store import iter_ctc_items, load_logprobs, as_float32
+from .search import EvalLog, grid_search, coarse_to_fine_search, bayes_search
+
+def build_nbest_table(items, lm_score):
+    """Score every candidate once and flatten the n-best lists into columns.
+
+    Candidates of utterance i live in [offsets[i], offsets[i+1]) of the
+    am/lm/nw/err arrays; err holds word errors against the utterance's ref.
+    """
+    am, lms, nw, err, ref_len = [], [], [], [], []
+    offsets = [0]
+    cache = {}
+    for it in items:
+        ref = normalize_text(it.get("ref","")).split()
+        ref_len.append(len(ref))
+        for c in it.get("cands") or []:
+            txt = normalize_text(c.get("text",""))
+            if txt not in cache:
+                cache[txt] = lm_score(txt)
+            words = txt.split()
+            am.append(float(c.get("am_score",0.0)))
+            lms.append(cache[txt])
+            nw.append(len(words))
+            err.append(word_errors(ref, words))
+        offsets.append(len(am))
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    return {
+        "am": np.asarray(am, dtype=np.float64),
+        "lm": np.asarray(lms, dtype=np.float64),
+        "nw": np.asarray(nw, dtype=np.float64),
+        "err": np.asarray(err, dtype=np.int64),
+        "offsets": offsets,
+        # reduceat needs non-empty segments; utterances without candidates are skipped
+        "starts": offsets[:-1][counts > 0],
+        "counts": counts[counts > 0],
+        # utterances without candidates decode to "" -> all their ref words are deleted
+        "has_cands": counts > 0,
+        "ref_len": np.asarray(ref_len, dtype=np.int64),
+    }
+
+def nbest_select(table, alphas, betas):
+    """Index of the best candidate per (non-empty) utterance for each (alpha, beta) pair.
+
+    alphas/betas are 1-D arrays of equal length G; returns an int array of shape (G, U).
+    Ties go to the earliest candidate, like the sequential `s > best_s` scan.
+    """
+    alphas = np.asarray(alphas, dtype=np.float64)[:, None]
+    betas = np.asarray(betas, dtype=np.float64)[:, None]
+    s = table["am"][None, :] + alphas * table["lm"][None, :] + betas * table["nw"][None, :]
+    seg_max = np.maximum.reduceat(s, table["starts"], axis=1)
+    is_max = s == np.repeat(seg_max, table["counts"], axis=1)
+    n = s.shape[1]
+    idx = np.where(is_max, np.arange(n)[None, :], n)
+    return np.minimum.reduceat(idx, table["starts"], axis=1)
+
+def nbest_grid_wer(table, alphas, betas, utts=None, max_cells=1 << 25):
+    """Corpus WER for every (alpha, beta) pair, evaluated in memory-bounded chunks of the grid.
+
+    utts optionally restricts scoring to a subset of utterance indices.
+    """
+    alphas = np.asarray(alphas, dtype=np.float64)
+    betas = np.asarray(betas, dtype=np.float64)
+    has = table["has_cands"]
+    mask = np.ones(len(has), dtype=bool)
+    if utts is not None:
+        mask[:] = False
+        mask[np.asarray(utts, dtype=np.int64)] = True
+    denom = max(int(table["ref_len"][mask].sum()), 1)
+    empty_err = int(table["ref_len"][mask & ~has].sum())
+    keep = mask[has]
+    out = np.empty(len(alphas), dtype=np.float64)
+    if len(table["starts"]) == 0:
+        out[:] = empty_err / denom
+        return out
+    step = max(1, max_cells // max(len(table["am"]), 1))
+    for i in range(0, len(alphas), step):
+        sel = nbest_select(table, alphas[i:i+step], betas[i:i+step])
+        out[i:i+step] = (table["err"][sel][:, keep].sum(axis=1) + empty_err) / denom
+    return out
+
+class NBestEvaluator:
+    def __init__(self, table):
+        self.table = table
+        self.n_utts = len(table["ref_len"])
+
+    def __call__(self, points, utts=None):
+        t0 = time.perf_counter()
+        ws = nbest_grid_wer(self.table, [a for a,_ in points], [b for _,b in points], utts=utts)
+        dt = (time.perf_counter() - t0) / max(len(points), 1)
+        return [(float(w), dt) for w in ws]
+
+    def close(self):
+        pass
+
+# per-process CTC state (decoder, items, logprobs or None, ref words), set up once by _init_ctc_worker
+_ctc = None
+
+def resident_logprobs(items):
+    """Logprobs of every item, read once in the parent so forked workers share them copy-on-write.
+
+    Per-file .npy arrays are read into memory rather than memory-mapped: one mapping per
+    utterance per process would run into vm.max_map_count (65530 by default) on large test
+    sets. Pack items stay views of their shard memmaps, a handful of mappings per process.
+    """
+    return [load_logprobs(it) if "shard" in it else as_float32(np.load(it["logprobs_path"])) for it in items]
+
+def _init_ctc_worker(labels, lm_bin, items, lps, refs):
+    global _ctc
+    from pyctcdecode import build_ctcdecoder
+    try:
+        decoder = build_ctcdecoder(labels, kenlm_model_path=lm_bin)
+    except Exception as e:
+        # a raising initializer makes Pool respawn workers forever; fail on first task instead
+        _ctc = e
+        return
+    _ctc = (decoder, items, lps, [r.split() for r in refs])
+
+def _ctc_grid_point(job):
+    if isinstance(_ctc, Exception):
+        raise _ctc
+    decoder, items, lps, refs = _ctc
+    a, b, utts = job
+    t0 = time.perf_counter()
+    decoder.reset_params(alpha=a, beta=b)
+    errs, n_ref = 0, 0
+    for i in (range(len(items)) if utts is None else utts):
+        # lazy mode reopens each array per grid point: bounded memory and at most one per-file
+        # mapping at a time, at the cost of re-reading every file for every point
+        lp = as_float32(lps[i] if lps is not None else load_logprobs(items[i]))
+        errs += word_errors(refs[i], normalize_text(decoder.decode(lp)).split())
+        n_ref += len(refs[i])
+    return errs, n_ref, time.perf_counter() - t0
+
+class CTCEvaluator:
+    """Decodes (alpha, beta) points; the worker pool and its decoders live across calls.
+
+    Logprobs are loaded once before the pool is forked (see resident_logprobs); lazy=True
+    instead reopens them at every grid point, for sets that do not fit in RAM.
+    """
+
+    def __init__(self, items, labels, lm_bin, workers=1, lazy=False):
+        self.n_utts = len(items)
+        refs = [normalize_text(it.get("ref","")) for it in items]
+        lps = None if lazy else resident_logprobs(items)
+        initargs = (labels, lm_bin, items, lps, refs)
+        self.pool = None
+        if workers > 1:
+            self.pool = Pool(workers, initializer=_init_ctc_worker, initargs=initargs)
+        else:
+            _init_ctc_worker(*initargs)
+
+    def __call__(self, points, utts=None):
+        jobs = [(a, b, utts) for a,b in points]
+        res = self.pool.map(_ctc_grid_point, jobs, chunksize=1) if self.pool else map(_ctc_grid_point, jobs)
+        return [(errs / max(n_ref, 1), dt) for errs, n_ref, dt in res]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+def write_results(path, rows):
+    # rows: list of {"alpha", "beta", "wer", ...}; format follows the extension
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if path.endswith(".json"):
+            json.dump(rows, f, indent=1)
+        else:
+            w = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            w.writeheader()
+            w.writerows(rows)
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--mode", choices=["nbest","ctc"], required=True)
-    ap.add_argument("--in_jsonl", required=True)
+    ap.add_argument("--in_jsonl", required=True, help="ctc mode also accepts a pack dir from wer_eval.logprob_store")
     ap.add_argument("--lm_bin", required=True)
     ap.add_argument("--alpha_grid", default="0.0,0.2,0.4,0.6,0.8,1.0")
     ap.add_argument("--beta_grid", default="-1.0,-0.5,0.0,0.5,1.0")
+    ap.add_argument("--workers", type=int, default=1, help="ctc mode: grid points decoded in parallel, one decoder per process")
+    ap.add_argument("--lazy_logprobs", action="store_true",
+                    help="ctc mode: reopen logprobs at every grid point instead of loading them once; for sets too large for RAM")
+    ap.add_argument("--results", default="", help="write WER of every evaluated point to this .csv or .json")
+    ap.add_argument("--search", choices=["grid","coarse_to_fine","bayes"], default="grid",
+                    help="grid: full Cartesian product on all utterances; others run --alpha_grid x --beta_grid "
+                         "on a subsample first, then refine on the full set")
+    ap.add_argument("--subsample", type=float, default=0.2, help="fraction (<=1) or count (>1) of utterances for the coarse pass")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--max_evals", type=int, default=20, help="cap on full-set evaluations after the coarse pass")
+    ap.add_argument("--patience", type=int, default=2, help="stop after this many rounds without a WER gain > --tol")
+    ap.add_argument("--tol", type=float, default=1e-4)
+    ap.add_argument("--log_jsonl", default="", help="append every evaluated point here; existing entries are reused on restart")
     args = ap.parse_args()
 
     alphas=[float(x) for x in args.alpha_grid.split(",")]
     betas=[float(x) for x in args.beta_grid.split(",")]
 
-    best = (1e9, None, None)
     # lazy import to avoid deps unless needed
     if args.mode=="nbest":
         import kenlm
         lm = kenlm.Model(args.lm_bin)
         def lm_score(txt): return float(lm.score(txt, bos=True, eos=True))
-        items=[json.loads(l) for l in open(args.in_jsonl,"r",encoding="utf-8")]
-        for a,b in itertools.product(alphas, betas):
-            refs=[]; hyps=[]
-            for it in items:
-                cands=it.get("cands") or []
-                best_h=""; best_s=-1e18
-                for c in cands:
-                    txt=normalize_text(c.get("text",""))
-                    am=float(c.get("am_score",0.0))
-                    s=am + a*lm_score(txt) + b*(len(txt.split()) if txt else 0)
-                    if s>best_s:
-                        best_s=s; best_h=txt
-                refs.append(normalize_text(it.get("ref","")))
-                hyps.append(best_h)
-            w=wer(refs, hyps)
-            if w<best[0]:
-                best=(w,a,b)
-        print(f"BEST WER={best[0]*100:.2f}% alpha={best[1]} beta={best[2]}")
+        with open(args.in_jsonl,"r",encoding="utf-8") as f:
+            evaluate=NBestEvaluator(build_nbest_table((json.loads(l) for l in f), lm_score))
     else:
-        # CTC: delegate to decode_ctc_kenlm for each grid is heavy; do direct pyctcdecode here
-        from pyctcdecode import build_ctcdecoder
-        import numpy as np
-        def load_labels(vocab_path: str):
-            if vocab_path.endswith(".json"):
-                m=json.load(open(vocab_path,"r",encoding="utf-8"))
-                items=sorted(((int(k),v) for k,v in m.items()), key=lambda x:x[0])
-                return [v for _,v in items]
-            else:
-                return [l.rstrip("\n") for l in open(vocab_path,"r",encoding="utf-8")]
-        first=json.loads(open(args.in_jsonl,"r",encoding="utf-8").readline())
-        labels=load_labels(first["vocab_path"])
-        decoder=build_ctcdecoder(labels, kenlm_model_path=args.lm_bin)
-        items=[json.loads(l) for l in open(args.in_jsonl,"r",encoding="utf-8")]
-        for a,b in itertools.product(alphas, betas):
-            refs=[]; hyps=[]
-            for it in items:
-                lp=np.load(it["logprobs_path"])
-                hyp=decoder.decode(lp, alpha=a, beta=b)
-                refs.append(normalize_text(it.get("ref","")))
-                hyps.append(normalize_text(hyp))
-            w=wer(refs, hyps)
-            if w<best[0]:
-                best=(w,a,b)
-        print(f"BEST WER={best[0]*100:.2f}% alpha={best[1]} beta={best[2]}")
+        from .decode_ctc_kenlm import load_labels
+        items=list(iter_ctc_items(args.in_jsonl))
+        labels=load_labels(items[0]["vocab_path"])
+        evaluate=CTCEvaluator(items, labels, args.lm_bin, workers=args.workers, lazy=args.lazy_logprobs)
+
+    log=EvalLog(evaluate, args.log_jsonl)
+    try:
+        if args.search=="grid":
+            grid_search(log, alphas, betas)
+        else:
+            rng=np.random.default_rng(args.seed)
+            n=evaluate.n_utts
+            k=int(round(args.subsample*n)) if args.subsample<=1 else int(args.subsample)
+            sub=np.sort(rng.choice(n, size=max(1, min(k, n)), replace=False)).tolist()
+            search=coarse_to_fine_search if args.search=="coarse_to_fine" else bayes_search
+            search(log, alphas, betas, sub, max_evals=args.max_evals, patience=args.patience,
+                   tol=args.tol, batch=max(args.workers, 1), seed=args.seed)
+    finally:
+        evaluate.close()
+        log.close()
+
+    if args.results:
+        write_results(args.results, log.rows)
+    best=log.best()
+    print(f"BEST WER={best['wer']*100:.2f}% alpha={best['alpha']} beta={best['beta']} "
+          f"(full-set evaluations: {log.n_full})")
 
 if __name__ == "__main__":
     main()